@@ -0,0 +1,30 @@
+import os
+import sys
+
+# The headless backend records input instead of sending it; no audio device is needed either.
+os.environ.setdefault("TWITCH_BOT_INPUT_BACKEND", "headless")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest
+
+import twitch_key_bot as bot
+
+HOLD_SECONDS = 0.2
+
+@pytest.fixture
+def backend():
+    """A fresh RecordingInputBackend installed as the active backend for one test."""
+    previous = bot.INPUT_LIB
+    recorder = bot.set_input_backend(bot.RecordingInputBackend())
+    yield recorder
+    bot.set_input_backend(previous)
+
+@pytest.fixture
+def config():
+    """Compiled default settings with window focusing off, so actions go straight to the backend."""
+    settings = {"focus_behavior": {"auto_focus_enabled": False}, "sound_on_redemption": {"enabled": False},
+                "key_behavior": {"hold_duration_seconds": HOLD_SECONDS, "hold_keys": ["w", "a", "s", "d"],
+                                 "single_press_keys": ["e", "space", "lmb", "rmb"]}}
+    bot.ensure_defaults(settings)
+    return bot.compile_settings(settings)
\ No newline at end of file
@@ -0,0 +1,28 @@
+import asyncio
+
+import pytest
+
+import twitch_key_bot as bot
+
+def run(line):
+    out = bot.CommandOutput(echo=False)
+    asyncio.run(bot.execute_command({}, line, out))
+    return out.lines
+
+@pytest.mark.parametrize("line", ["profile", "profile   ", "profile bogus", "profile start soon"])
+def test_profile_usage(line):
+    assert run(line)[-1].startswith("Usage: profile start")
+    assert not bot.PROFILER.active
+
+def test_profile_writes_the_file_named_in_help(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "PROFILE_DIR", str(tmp_path))
+    async def session():
+        out = bot.CommandOutput(echo=False)
+        await bot.execute_command({}, "profile start sample", out)
+        await asyncio.sleep(0.05)
+        await bot.execute_command({}, "profile stop", out)
+        return out.lines
+    lines = asyncio.run(session())
+    (written,) = tmp_path.iterdir()
+    assert lines[-1] == f"Profile written to {written}"
+    assert written.name.startswith("profile-") and written.suffix == ".folded"
\ No newline at end of file
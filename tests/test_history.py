@@ -0,0 +1,71 @@
+import sqlite3
+import time
+
+import pytest
+
+import twitch_key_bot as bot
+
+@pytest.fixture
+def history(tmp_path, monkeypatch):
+    monkeypatch.setattr(bot, "HISTORY_FLUSH_SECONDS", 60.0)  # only close() or a full batch writes
+    store = bot.HistoryStore()
+    store.open({"history": {"path": str(tmp_path / "history.db")}})
+    yield store
+    store.close()
+
+def event(user, title, reward_id=None, user_input=None):
+    return {"user_name": user, "reward": {"title": title, "id": reward_id}, "user_input": user_input}
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+def test_rows_are_buffered_then_written_in_one_batch(history, monkeypatch):
+    batches = []
+    write = history._write
+    monkeypatch.setattr(history, "_write", lambda conn, rows: (batches.append(len(rows)), write(conn, rows)))
+    for i in range(3): history.record(event(f"user{i}", "Jump", "r1"), "ok")
+    assert history.written == 0 and history.metrics()["buffered"] == 3
+    history.close()
+    assert batches == [3] and history.metrics() == {"written": 3, "failed": 0, "buffered": 0}
+
+def test_full_batch_wakes_the_writer(history):
+    for i in range(bot.HISTORY_BATCH_SIZE): history.record(event("viewer", "Jump", "r1"), "ok")
+    wait_for(lambda: history.written == bot.HISTORY_BATCH_SIZE)
+
+def test_recent_filters_and_orders(history):
+    history.record(event("Alice", "Jump", "r1"), "ok", time.perf_counter())
+    history.record(event("bob", "Walk", "r2", "hold w 3"), "rejected")
+    history.record(event("alice", "Walk", "r2"), "throttled")
+    history.close()
+    assert [row[1:5] for row in history.recent(10)] == [
+        ("alice", "Walk", None, "throttled"), ("bob", "Walk", "hold w 3", "rejected"), ("Alice", "Jump", None, "ok")]
+    assert [row[2] for row in history.recent(10, user="ALICE")] == ["Walk", "Jump"]
+    assert [row[1] for row in history.recent(1, reward="walk")] == ["alice"]
+    assert history.recent(10)[2][5] is not None and history.recent(10)[0][5] is None  # latency only with a receive time
+
+def test_totals_survive_reward_renames(history):
+    history.record(event("alice", "Old Name", "r1"), "ok")
+    history.record(event("bob", "New Name", "r1"), "ok")
+    history.record(event("alice", "Test", None), "ok")
+    history.close()
+    assert [row[:2] for row in history.top("reward_totals", 10)] == [("New Name", 2), ("Test", 1)]
+    assert [row[:2] for row in history.top("user_totals", 1)] == [("alice", 2)]
+
+def test_queries_use_indexes(history):
+    history.close()
+    conn = sqlite3.connect(history.path)
+    plan = lambda sql: " ".join(row[3] for row in conn.execute("EXPLAIN QUERY PLAN " + sql, ("x",) if "?" in sql else ()))
+    assert "idx_redemptions_user" in plan("SELECT ts FROM redemptions WHERE user = ? COLLATE NOCASE ORDER BY ts DESC")
+    assert "idx_reward_totals_count" in plan("SELECT reward, count FROM reward_totals ORDER BY count DESC")
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    conn.close()
+
+def test_disabled_history_records_nothing(tmp_path):
+    store = bot.HistoryStore()
+    store.open({"history": {"enabled": False, "path": str(tmp_path / "history.db")}})
+    store.record(event("alice", "Jump"), "ok")
+    assert store.path is None and store.metrics()["buffered"] == 0
+    assert not (tmp_path / "history.db").exists()
\ No newline at end of file
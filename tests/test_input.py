@@ -0,0 +1,215 @@
+import asyncio
+import ctypes
+from types import SimpleNamespace
+
+import pytest
+
+import twitch_key_bot as bot
+from conftest import HOLD_SECONDS
+from twitch_key_bot import InputGrammar, ParsedInput
+
+def ops(backend):
+    return [(op, args) for _, op, args in backend.calls]
+
+# --- key actions on the headless backend ---
+@pytest.mark.parametrize("key, expected", [
+    ("e", [("press", ("e",))]),
+    ("SPACEBAR", [("press", ("space",))]),
+    ("lmb", [("click", ("left",))]),
+    ("x", [("press", ("x",))]),  # not configured: falls back to a single press
+])
+def test_tap(backend, config, key, expected):
+    assert asyncio.run(bot.handle_key_action(key, config))
+    assert ops(backend) == expected
+
+def test_hold_keeps_the_key_down_for_hold_duration(backend, config):
+    assert asyncio.run(bot.handle_key_action("w", config))
+    (down_at, down, _), (up_at, up, _) = backend.calls
+    assert (down, up) == ("keyDown", "keyUp")
+    assert HOLD_SECONDS - 0.005 <= up_at - down_at < HOLD_SECONDS + 0.1
+
+def test_chord_goes_out_as_one_batch(backend, config):
+    assert asyncio.run(bot.handle_key_action("ctrl+e", config))
+    assert ops(backend) == [("keyDown", ("ctrl",)), ("keyDown", ("e",)), ("keyUp", ("e",)), ("keyUp", ("ctrl",))]
+    assert len({at for at, _, _ in backend.calls}) == 1
+
+def test_chord_with_a_hold_key_is_held(backend, config):
+    assert asyncio.run(bot.handle_key_action("ctrl+w", config))
+    assert ops(backend) == [("keyDown", ("ctrl",)), ("keyDown", ("w",)), ("keyUp", ("w",)), ("keyUp", ("ctrl",))]
+    (down_at, *_), _, (up_at, *_), _ = backend.calls
+    assert HOLD_SECONDS - 0.005 <= up_at - down_at < HOLD_SECONDS + 0.1
+
+@pytest.mark.parametrize("key, expected", [
+    ("w", [("keyDown", ("w",)), ("keyUp", ("w",))]),
+    ("ctrl+w", [("keyDown", ("ctrl",)), ("keyDown", ("w",)), ("keyUp", ("w",)), ("keyUp", ("ctrl",))]),
+])
+def test_drained_hold_releases_its_keys(backend, config, monkeypatch, key, expected):
+    monkeypatch.setattr(bot, "BACKPRESSURE", bot.BackpressureController())
+    async def run():
+        bot.BACKPRESSURE.track(asyncio.create_task(bot.handle_key_action(key, config)))
+        await bot.BACKPRESSURE.drain(timeout=HOLD_SECONDS / 4)  # shutdown while the key is still held
+    asyncio.run(run())
+    assert ops(backend) == expected
+    assert backend.calls[-1][0] - backend.calls[0][0] < HOLD_SECONDS / 2
+
+def test_empty_key_is_rejected(backend, config):
+    assert asyncio.run(bot.handle_key_action("", config)) is False
+    assert backend.calls == []
+
+# --- InputBatcher ---
+def test_batcher_keeps_submission_order(backend):
+    async def run():
+        batcher = bot.InputBatcher()
+        first = batcher.submit(("keyDown", "w"), ("keyDown", "e"))
+        second = batcher.submit(("keyUp", "e"))
+        third = batcher.submit(("press", "space"))
+        await asyncio.gather(first, second, third)
+        return batcher
+    batcher = asyncio.run(run())
+    assert ops(backend) == [("keyDown", ("w",)), ("keyDown", ("e",)), ("keyUp", ("e",)), ("press", ("space",))]
+    assert batcher.batches == 1 and batcher.events == 4 and batcher.depth() == 0
+
+def test_batcher_tick_groups_later_submits(backend):
+    async def run():
+        batcher = bot.InputBatcher(tick=0.02)
+        first = batcher.submit(("press", "a"))
+        await asyncio.sleep(0)
+        second = batcher.submit(("press", "b"))
+        await asyncio.gather(first, second)
+        await batcher.submit(("press", "c"))
+        return batcher
+    batcher = asyncio.run(run())
+    assert [args[0] for _, _, args in backend.calls] == ["a", "b", "c"]
+    assert batcher.batches == 2
+
+def test_batcher_reports_backend_errors(backend):
+    def broken(events): raise OSError("input blocked")
+    backend.batch = broken
+    async def run():
+        batcher = bot.InputBatcher()
+        return await asyncio.gather(batcher.submit(("press", "a")), batcher.submit(("press", "b")), return_exceptions=True)
+    assert all(isinstance(result, OSError) for result in asyncio.run(run()))
+
+# --- PyDirectInputBackend.batch ---
+class KeyBdInput(ctypes.Structure):
+    _fields_ = [("wVk", ctypes.c_ushort), ("wScan", ctypes.c_ushort), ("dwFlags", ctypes.c_ulong),
+                ("time", ctypes.c_ulong), ("dwExtraInfo", ctypes.POINTER(ctypes.c_ulong))]
+
+class Input_I(ctypes.Union):
+    _fields_ = [("ki", KeyBdInput)]
+
+class Input(ctypes.Structure):
+    _fields_ = [("type", ctypes.c_ulong), ("ii", Input_I)]
+
+@pytest.fixture
+def directinput():
+    """A stand-in pydirectinput module that records SendInput scancodes and per-key calls."""
+    sent, calls = [], []
+    lib = SimpleNamespace(Input=Input, Input_I=Input_I, KeyBdInput=KeyBdInput,
+                          KEYBOARD_MAPPING={"ctrl": 0x1D, "e": 0x12, "up": 0x48, "pagedown": 0xE051},
+                          SendInput=lambda n, array, size: sent.extend((i.ii.ki.wScan, i.ii.ki.dwFlags) for i in array),
+                          keyDown=lambda key: calls.append(("keyDown", key)), keyUp=lambda key: calls.append(("keyUp", key)))
+    return bot.PyDirectInputBackend(lib), sent, calls
+
+def test_directinput_batch_is_one_sendinput(directinput):
+    backend, sent, calls = directinput
+    backend.batch([("keyDown", "ctrl"), ("press", "pagedown"), ("keyUp", "ctrl")])
+    scan, up, extended = bot.KEYEVENTF_SCANCODE, bot.KEYEVENTF_KEYUP, bot.KEYEVENTF_EXTENDEDKEY
+    assert sent == [(0x1D, scan), (0x51, scan | extended), (0x51, scan | up | extended), (0x1D, scan | up)]
+    assert calls == []
+
+def test_directinput_arrow_keys_go_out_per_key(directinput):
+    backend, sent, calls = directinput
+    backend.batch([("keyDown", "ctrl"), ("keyDown", "up"), ("keyUp", "up"), ("keyUp", "ctrl")])
+    assert sent == [] and calls == [("keyDown", "ctrl"), ("keyDown", "up"), ("keyUp", "up"), ("keyUp", "ctrl")]
+
+# --- InputGrammar ---
+GRAMMAR = {"keys": ["w", "e", "lmb", "spacebar"], "max_seconds": 5, "max_repeat": 10}
+
+@pytest.mark.parametrize("text, expected", [
+    ("hold w 3", ParsedInput("hold", "w", seconds=3.0)),
+    ("hold w 2.5s", ParsedInput("hold", "w", seconds=2.5)),
+    ("HOLD W", ParsedInput("hold", "w", seconds=1.0)),
+    ("press e x5", ParsedInput("press", "e", repeat=5)),
+    ("press e 10", ParsedInput("press", "e", repeat=10)),
+    ("e", ParsedInput("press", "e")),
+    ("  press   lmb  ", ParsedInput("press", "lmb")),
+    ("spacebar", ParsedInput("press", "space")),
+])
+def test_grammar_accepts(text, expected):
+    assert InputGrammar(GRAMMAR).parse(text) == expected
+
+@pytest.mark.parametrize("text", [
+    "", "   ", "w" * (bot.USER_INPUT_MAX_LENGTH + 1),
+    "jump", "press q", "hold",
+    "hold w 0", "hold w 5.1", "hold w 31", "hold w -1", "hold w 1e3", "hold w nan", "hold w 1.2.3",
+    "press e x0", "press e 11", "press e x99999", "press e 3.5",
+    "press e 2 3", "press w e",
+])
+def test_grammar_rejects(text):
+    with pytest.raises(ValueError):
+        InputGrammar(GRAMMAR).parse(text)
+
+def test_grammar_bounds_are_capped():
+    grammar = InputGrammar({"keys": "w", "max_seconds": 1000, "max_repeat": 1000})
+    assert grammar.max_seconds == bot.USER_INPUT_MAX_SECONDS and grammar.max_repeat == bot.USER_INPUT_MAX_REPEAT
+    assert grammar.parse("hold w 30").seconds == 30.0
+    with pytest.raises(ValueError): grammar.parse("hold w 31")
+
+def test_grammar_verbs_are_per_binding():
+    grammar = InputGrammar({"keys": ["w"], "verbs": ["hold"]})
+    assert grammar.parse("w").verb == "hold"
+    with pytest.raises(ValueError): grammar.parse("press w")
+
+@pytest.mark.parametrize("spec", [{}, {"keys": []}, {"keys": ["w"], "verbs": ["tap"]}, {"keys": ["w"], "verbs": []}])
+def test_grammar_spec_validation(spec):
+    with pytest.raises(ValueError):
+        InputGrammar(spec)
+
+# --- viewer input actions ---
+def test_cancelled_hold_releases_input(backend, config):
+    async def run(command):
+        task = asyncio.create_task(bot.handle_parsed_input(command, config))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    asyncio.run(run(ParsedInput("hold", "w", seconds=30)))
+    asyncio.run(run(ParsedInput("hold", "lmb", seconds=30)))
+    assert ops(backend) == [("keyDown", ("w",)), ("keyUp", ("w",)), ("mouseDown", ("left",)), ("mouseUp", ("left",))]
+
+def test_chord_press_is_ordered(backend, config):
+    assert asyncio.run(bot.handle_parsed_input(ParsedInput("press", "ctrl+e"), config))
+    assert [(op, args[0]) for _, op, args in backend.calls] == [
+        ("keyDown", "ctrl"), ("keyDown", "e"), ("keyUp", "e"), ("keyUp", "ctrl")]
+
+# --- backpressure ---
+@pytest.fixture
+def controller(backend, config, monkeypatch):
+    """Routes redemptions of a "Walk" viewer-input reward through a fresh BackpressureController."""
+    settings = {"focus_behavior": {"auto_focus_enabled": False}, "sound_on_redemption": {"enabled": False},
+                "rewards": {"Walk": {"action": "user_input", "keys": "w"}}}
+    bot.ensure_defaults(settings)
+    monkeypatch.setattr(bot, "CONFIG", bot.compile_settings(settings))
+    monkeypatch.setattr(bot, "BACKPRESSURE", bot.BackpressureController())
+    monkeypatch.setattr(bot, "_LAST_TRIGGER", {})
+    return bot.BACKPRESSURE
+
+def test_running_hold_is_not_backlog_wait(controller, backend):
+    async def run():
+        await bot.handle_redemption_event({"user_name": "viewer", "reward": {"title": "Walk"}, "user_input": "hold w 1"})
+        await asyncio.sleep(HOLD_SECONDS)
+        backlog = controller.backlog()
+        await controller.drain(timeout=0)
+        return backlog
+    assert asyncio.run(run()) == (1, 0.0)  # in flight for HOLD_SECONDS, but its key went down right away
+    assert ops(backend) == [("keyDown", ("w",)), ("keyUp", ("w",))]
+
+def test_undispatched_action_counts_as_wait(controller):
+    async def run():
+        controller.track(asyncio.create_task(asyncio.sleep(1)))
+        await asyncio.sleep(HOLD_SECONDS)
+        depth, wait = controller.backlog()
+        await controller.drain(timeout=0)
+        return depth, wait
+    depth, wait = asyncio.run(run())
+    assert depth == 1 and wait >= HOLD_SECONDS - 0.005
@@ -0,0 +1,93 @@
+import json
+
+import pytest
+
+import twitch_key_bot as bot
+
+def defaults(**overrides):
+    settings = {"sound_on_redemption": {"enabled": False}, **overrides}
+    bot.ensure_defaults(settings)
+    return settings
+
+# --- compile_settings ---
+def test_compile_defaults():
+    config = bot.compile_settings(defaults())
+    assert config.bindings["example reward"].action == "space"
+    assert "w" in config.key_behavior.hold_keys and config.key_behavior.hold_duration == 1.0
+    assert not config.redemptions.enabled and not config.backpressure.enabled
+
+def test_compile_bindings_are_normalized():
+    config = bot.compile_settings(defaults(rewards={
+        "  Jump ": "space",
+        "Aim": {"action": "mouse_move", "x": 10, "y": 0, "easing": "zigzag"},  # bad binding: skipped, not fatal
+        "Walk": {"action": "user_input", "keys": "w,a"},
+        "Honk": {"sound": "sounds/alert.ogg", "volume": 3},
+    }))
+    assert set(config.bindings) == {"jump", "walk", "honk"}
+    assert isinstance(config.bindings["walk"].action, bot.InputGrammar)
+    assert config.bindings["honk"].action is None and config.bindings["honk"].volume == 1.0
+
+@pytest.mark.parametrize("overrides", [
+    {"rewards": ["space"]},
+    {"key_behavior": "fast"},
+    {"key_behavior": {"hold_duration_seconds": "long"}},
+    {"sound_on_redemption": {"volume": "loud"}},
+    {"backpressure": {"high_watermark": "many"}},
+    {"backpressure": {"high_watermark": 5, "low_watermark": 5}},  # would never resume
+])
+def test_compile_rejects_invalid_sections(overrides):
+    with pytest.raises(ValueError):
+        bot.compile_settings(defaults(**overrides))
+
+def test_compile_clamps_values():
+    config = bot.compile_settings(defaults(sound_on_redemption={"enabled": True, "volume": 7, "order": "key_first"}))
+    assert config.sound.volume == 1.0 and config.sound.key_first
+    config = bot.compile_settings(defaults(backpressure={"high_watermark": 0, "low_watermark": -3}))
+    assert (config.backpressure.high_watermark, config.backpressure.low_watermark) == (1, 0)
+
+def test_compiled_snapshot_is_immutable():
+    config = bot.compile_settings(defaults())
+    with pytest.raises(AttributeError): config.sound = None
+    with pytest.raises(TypeError): config.bindings["new"] = bot.Binding("e")
+
+def test_compile_reuses_untouched_sections():
+    previous = bot.compile_settings(defaults())
+    settings = defaults(rewards={"Jump": "space"}, key_behavior="not even an object")
+    config = bot.compile_settings(settings, previous, ("rewards",))
+    assert config.key_behavior is previous.key_behavior and config.sound is previous.sound
+    assert set(config.bindings) == {"jump"}
+
+# --- SettingsStore ---
+@pytest.fixture
+def store(tmp_path):
+    return bot.SettingsStore(str(tmp_path / "bot_settings.json"), delay=60)
+
+def read(path):
+    with open(path, "r", encoding="utf-8") as f: return json.load(f)
+
+def test_store_coalesces_and_rotates_backup(store, tmp_path):
+    store.save({"v": 1}); store.flush()
+    store.save({"v": 2}); store.save({"v": 3}); store.flush()
+    assert read(store.path) == {"v": 3} and read(store.backup_path) == {"v": 1}
+    assert store.writes == 2
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["bot_settings.json", "bot_settings.json.bak"]
+
+def test_store_snapshots_on_save(store):
+    settings = {"v": 1}
+    store.save(settings); settings["v"] = 2
+    store.flush()
+    assert read(store.path) == {"v": 1}
+
+def test_store_keeps_good_backup_over_corrupt_file(store):
+    store.save({"v": 1}); store.flush()
+    store.save({"v": 2}); store.flush()
+    with open(store.path, "w", encoding="utf-8") as f: f.write("{ broken")
+    store.save({"v": 3}); store.flush()
+    assert read(store.path) == {"v": 3} and read(store.backup_path) == {"v": 1}
+
+def test_store_load_falls_back_to_backup(store):
+    assert store.load() == {}
+    store.save({"v": 1}); store.flush()
+    store.save({"v": 2}); store.flush()
+    with open(store.path, "w", encoding="utf-8") as f: f.write("{ broken")
+    assert store.load() == {"v": 1}
@@ -1,15 +1,31 @@
 import asyncio
+import concurrent.futures
+import cProfile
+import hashlib
+import hmac
 import json
 import logging
+import logging.handlers
 import os
+import queue
 import re
+import secrets
 import shlex
+import sqlite3
 import sys
-from time import time
+import threading
+import traceback
+import tracemalloc
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass, replace
+from time import localtime, perf_counter, strftime, time
+from types import MappingProxyType
+from urllib.parse import urlsplit
+_PROCESS_START = perf_counter()
 import aiohttp
 import websockets
-import pyautogui
-import pygame
 
 # --- CONFIGURATION & LOGGING ---
 SETTINGS_FILE = "bot_settings.json"
@@ -26,79 +42,1043 @@ def set_logging_paused(paused: bool):
         logging.disable(logging.NOTSET) # Включаем все уровни обратно
         logging.getLogger(__name__).info("Logging has been RESUMED.")
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format="%(asctime)s [%(levelname)s] %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S",
-    handlers=[logging.StreamHandler(sys.stdout)]
-)
+LOG_FORMAT = "%(asctime)s [%(levelname)s] %(message)s"
+LOG_DATEFMT = "%Y-%m-%d %H:%M:%S"
+LOG_SAMPLE_PER_SECOND = 5
+
+class _DeferredQueueHandler(logging.handlers.QueueHandler):
+    """Merges msg % args on the caller's thread, since the arguments (events, settings) may change
+    afterwards; timestamps, layout and exception text are still formatted on the listener thread."""
+    def prepare(self, record):
+        record.msg, record.args = record.getMessage(), None
+        return record
+
+class _LogListener(logging.handlers.QueueListener):
+    """A QueueListener that also runs callables found in the queue, so sink changes apply on the
+    listener thread in log order without stopping it."""
+    def handle(self, record):
+        if callable(record): record()
+        else: super().handle(record)
+
+class BurstSampler(logging.Filter):
+    """Lets at most `per_second` records per message template through for records logged with
+    extra={"sample": True}; the rest are counted and reported in one summary line per template."""
+    def __init__(self, per_second=LOG_SAMPLE_PER_SECOND):
+        super().__init__()
+        self.per_second, self.suppressed_total = per_second, 0
+        self._window, self._counts, self._suppressed = 0, {}, {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not getattr(record, "sample", False) or self.per_second <= 0: return True
+        window, summary = int(record.created), None
+        with self._lock:
+            if window != self._window:
+                self._window, self._counts = window, {}
+                summary, self._suppressed = self._suppressed, {}
+            count = self._counts[record.msg] = self._counts.get(record.msg, 0) + 1
+            if count > self.per_second:
+                self._suppressed[record.msg] = self._suppressed.get(record.msg, 0) + 1; self.suppressed_total += 1
+        if summary: self._report(summary)
+        return count <= self.per_second
+
+    def flush(self):
+        with self._lock: summary, self._suppressed = self._suppressed, {}
+        if summary: self._report(summary)
+
+    @staticmethod
+    def _report(summary):
+        for msg, count in summary.items(): logger.info("Sampling suppressed %d more lines like: %s", count, msg)
+
+class JsonLineFormatter(logging.Formatter):
+    """One JSON object per record, for the optional rotating file sink."""
+    def format(self, record):
+        entry = {"time": self.formatTime(record, LOG_DATEFMT), "ts": round(record.created, 3),
+                 "level": record.levelname, "msg": record.getMessage()}
+        if record.exc_info: entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+# The event loop only enqueues records; one listener thread writes them to stdout and the optional file.
+_LOG_QUEUE = queue.SimpleQueue()
+_LOG_SAMPLER = BurstSampler()
+_LOG_HANDLER = _DeferredQueueHandler(_LOG_QUEUE); _LOG_HANDLER.addFilter(_LOG_SAMPLER)
+_CONSOLE_HANDLER = logging.StreamHandler(sys.stdout)
+_CONSOLE_HANDLER.setFormatter(logging.Formatter(LOG_FORMAT, LOG_DATEFMT))
+_JSON_HANDLER, _JSON_SINK = None, None
+logging.basicConfig(level=logging.DEBUG, handlers=[_LOG_HANDLER])
 logger = logging.getLogger(__name__)
+_LOG_LISTENER = _LogListener(_LOG_QUEUE, _CONSOLE_HANDLER)
+_LOG_LISTENER.start()
+
+def configure_log_sinks(settings):
+    """Applies the optional "logging" settings: sampling rate and a rotating JSON-lines file."""
+    global _JSON_HANDLER, _JSON_SINK
+    cfg = settings.get("logging") or {}
+    try:
+        per_second = int(cfg.get("sample_per_second", LOG_SAMPLE_PER_SECOND))
+        path = cfg.get("json_file") or None
+        sink = (path, int(cfg.get("max_bytes", 5 * 1024 * 1024)), int(cfg.get("backup_count", 3))) if path else None
+    except (TypeError, ValueError, AttributeError) as e:
+        logger.error("Invalid 'logging' settings: %s", e); return
+    _LOG_SAMPLER.per_second = per_second
+    if sink == _JSON_SINK: return
+    json_handler = None
+    if sink:
+        json_handler = logging.handlers.RotatingFileHandler(path, maxBytes=sink[1], backupCount=sink[2], encoding="utf-8", delay=True)
+        json_handler.setFormatter(JsonLineFormatter())
+    old, _JSON_HANDLER, _JSON_SINK = _JSON_HANDLER, json_handler, sink
+    def swap():  # runs on the listener thread: earlier records still reach the old sinks
+        _LOG_LISTENER.handlers = tuple(filter(None, (_CONSOLE_HANDLER, json_handler)))
+        if old: old.close()
+    _LOG_QUEUE.put_nowait(swap)
+
+def shutdown_logging():
+    _LOG_SAMPLER.flush()
+    _LOG_LISTENER.stop()
+    if _JSON_HANDLER: _JSON_HANDLER.close()
 
 STOP_EVENT = asyncio.Event()
 RESTART_FLAG = False
 
-# --- PREFERRED LIBRARIES SETUP ---
-try:
-    import pydirectinput
-    pydirectinput.FAILSAFE = False; pydirectinput.PAUSE = 0
-    INPUT_LIB = pydirectinput
-    logger.info("Using pydirectinput for input emulation (recommended for games).")
-except ImportError:
-    pyautogui.FAILSAFE = False; pyautogui.PAUSE = 0
-    INPUT_LIB = pyautogui
-    logger.warning("pydirectinput not found, falling back to pyautogui (may not work in some games).")
+# --- STARTUP PROFILE ---
+# Heavy modules (pygame, pydirectinput/pyautogui, pygetwindow, psutil, numpy) are imported lazily or on
+# worker threads during startup; `--startup-profile` prints when each phase ran relative to process start.
+STARTUP_PROFILE = "--startup-profile" in sys.argv
+_STARTUP_PHASES = []
+_STARTUP_REPORTED = False
 
-try:
-    import pygetwindow as gw
-    logger.info("pygetwindow is available for window focusing.")
-except ImportError:
-    gw = None; logger.warning("pygetwindow not found, window focusing disabled.")
+def startup_phase(name, start, end=None):
+    if STARTUP_PROFILE and not _STARTUP_REPORTED:
+        _STARTUP_PHASES.append((name, start - _PROCESS_START, (end or perf_counter()) - _PROCESS_START))
 
-try:
-    import psutil
-except ImportError:
-    psutil = None; logger.warning("psutil not found, automatic game window detection disabled.")
+def timed_phase(name, fn, *args):
+    """Runs `fn(*args)` and records it as a startup phase; used for jobs handed to worker threads."""
+    start = perf_counter()
+    try: return fn(*args)
+    finally: startup_phase(name, start)
+
+def report_startup_profile():
+    global _STARTUP_REPORTED
+    if not STARTUP_PROFILE or _STARTUP_REPORTED: return
+    _STARTUP_REPORTED = True
+    print("\n--- STARTUP PROFILE (ms since process start) ---", flush=True)
+    for name, start, end in sorted(_STARTUP_PHASES, key=lambda p: p[1]):
+        print(f"  {name:<28} {start * 1000:8.1f} -> {end * 1000:8.1f}  ({(end - start) * 1000:7.1f} ms)", flush=True)
+    print(f"  {'ready for redemptions':<28} {(perf_counter() - _PROCESS_START) * 1000:8.1f}", flush=True)
+    print("------------------------------------------------\n", flush=True)
+
+# --- INPUT BACKENDS ---
+class InputBackend(ABC):
+    """Common interface for input emulation. `capabilities()` tells callers which operations are real."""
+    name = "base"
+    caps = frozenset()
+
+    def capabilities(self): return self.caps
+    @abstractmethod
+    def keyDown(self, key): ...
+    @abstractmethod
+    def keyUp(self, key): ...
+    def press(self, key): self.keyDown(key); self.keyUp(key)
+    @abstractmethod
+    def click(self, button="left"): ...
+    @abstractmethod
+    def moveRel(self, dx, dy): ...
+    @abstractmethod
+    def moveTo(self, x, y): ...
+    @abstractmethod
+    def mouseDown(self, button="left"): ...
+    @abstractmethod
+    def mouseUp(self, button="left"): ...
+    @abstractmethod
+    def position(self): ...
+
+    def batch(self, events):
+        """Sends a list of (operation, *args) tuples. Without native batch support they go out one by one."""
+        for op, *args in events: getattr(self, op)(*args)
+
+class LibraryInputBackend(InputBackend):
+    """Wraps a pyautogui-compatible module (pyautogui, pydirectinput)."""
+    def __init__(self, lib, name):
+        self.lib, self.name = lib, name
+        lib.FAILSAFE = False; lib.PAUSE = 0
+        caps = {"keyboard"}
+        if hasattr(lib, "click"): caps.add("mouse_click")
+        if all(hasattr(lib, n) for n in ("moveRel", "moveTo", "mouseDown", "mouseUp", "position")): caps.add("mouse_move")
+        self.caps = frozenset(caps)
+
+    def keyDown(self, key): self.lib.keyDown(key)
+    def keyUp(self, key): self.lib.keyUp(key)
+    def press(self, key): self.lib.press(key)
+    def click(self, button="left"): self.lib.click(button=button)
+    def moveRel(self, dx, dy): self.lib.moveRel(dx, dy)
+    def moveTo(self, x, y): self.lib.moveTo(x, y)
+    def mouseDown(self, button="left"): self.lib.mouseDown(button=button)
+    def mouseUp(self, button="left"): self.lib.mouseUp(button=button)
+    def position(self): return tuple(self.lib.position())
+
+KEYEVENTF_EXTENDEDKEY, KEYEVENTF_KEYUP, KEYEVENTF_SCANCODE = 0x0001, 0x0002, 0x0008
+# pydirectinput flags these as extended by name (plus a NumLock workaround), not through KEYBOARD_MAPPING.
+PYDIRECTINPUT_EXTENDED_KEYS = frozenset({"up", "down", "left", "right"})
+
+class PyDirectInputBackend(LibraryInputBackend):
+    def __init__(self, lib):
+        super().__init__(lib, "pydirectinput")
+        if all(hasattr(lib, n) for n in ("SendInput", "Input", "Input_I", "KeyBdInput", "KEYBOARD_MAPPING")):
+            self.caps = self.caps | {"batch"}
+
+    # Raw relative movement is what games read; the default path moves the cursor in absolute coordinates.
+    def moveRel(self, dx, dy): self.lib.moveRel(dx, dy, relative=True)
+
+    def batch(self, events):
+        """Injects keyboard events with a single SendInput call; anything else goes out sequentially."""
+        strokes = []
+        for op, *args in events:
+            if op == "press": strokes += [(args[0], False), (args[0], True)]
+            elif op in ("keyDown", "keyUp"): strokes.append((args[0], op == "keyUp"))
+            else: strokes = None; break
+        if "batch" not in self.caps or not strokes or any(
+                k not in self.lib.KEYBOARD_MAPPING or k in PYDIRECTINPUT_EXTENDED_KEYS for k, _ in strokes):
+            return super().batch(events)
+        import ctypes
+        lib, extra, inputs = self.lib, ctypes.c_ulong(0), []
+        for key, up in strokes:
+            code, flags = lib.KEYBOARD_MAPPING[key], KEYEVENTF_SCANCODE | (KEYEVENTF_KEYUP if up else 0)
+            if code >= 0xE000: code -= 0xE000; flags |= KEYEVENTF_EXTENDEDKEY
+            ii_ = lib.Input_I()
+            ii_.ki = lib.KeyBdInput(0, code, flags, 0, ctypes.pointer(extra))
+            inputs.append(lib.Input(ctypes.c_ulong(1), ii_))
+        lib.SendInput(len(inputs), (lib.Input * len(inputs))(*inputs), ctypes.sizeof(lib.Input))
+
+class RecordingInputBackend(InputBackend):
+    """Headless backend: records every call as (timestamp, operation, args) instead of sending input."""
+    name = "headless"
+    caps = frozenset({"keyboard", "mouse_click", "mouse_move", "batch"})
+
+    def __init__(self, clock=perf_counter):
+        self.clock = clock
+        self.calls = []
+        self.cursor = (0, 0)
+
+    def _record(self, op, *args): self.calls.append((self.clock(), op, args))
+    def keyDown(self, key): self._record("keyDown", key)
+    def keyUp(self, key): self._record("keyUp", key)
+    def press(self, key): self._record("press", key)
+    def click(self, button="left"): self._record("click", button)
+    def moveRel(self, dx, dy): self.cursor = (self.cursor[0] + dx, self.cursor[1] + dy); self._record("moveRel", dx, dy)
+    def moveTo(self, x, y): self.cursor = (x, y); self._record("moveTo", x, y)
+    def mouseDown(self, button="left"): self._record("mouseDown", button)
+    def mouseUp(self, button="left"): self._record("mouseUp", button)
+    def position(self): return self.cursor
+    def clear(self): self.calls.clear()
+
+    def batch(self, events):
+        now = self.clock()
+        for op, *args in events:
+            if op in ("moveRel", "moveTo"): getattr(self, op)(*args); self.calls[-1] = (now,) + self.calls[-1][1:]
+            else: self.calls.append((now, op, tuple(args)))
+
+INPUT_BACKEND_NAMES = ("auto", "pydirectinput", "pyautogui", "headless")
+
+def create_input_backend(name=None):
+    """Picks an input backend: `name` or $TWITCH_BOT_INPUT_BACKEND, else pydirectinput > pyautogui > headless."""
+    name = (name or os.environ.get("TWITCH_BOT_INPUT_BACKEND") or "auto").strip().lower()
+    if name not in INPUT_BACKEND_NAMES:
+        logger.error("Unknown input backend '%s' (expected one of: %s); detecting one automatically.", name, ", ".join(INPUT_BACKEND_NAMES))
+        name = "auto"
+    if name == "headless": return RecordingInputBackend()
+    if name in ("auto", "pydirectinput"):
+        try:
+            import pydirectinput
+            logger.info("Using pydirectinput for input emulation (recommended for games).")
+            return PyDirectInputBackend(pydirectinput)
+        except Exception:
+            logger.warning("pydirectinput not found, falling back to pyautogui (may not work in some games).")
+    if name in ("auto", "pydirectinput", "pyautogui"):
+        try:
+            import pyautogui
+            return LibraryInputBackend(pyautogui, "pyautogui")
+        except Exception as e:
+            logger.warning("pyautogui is unavailable (%s).", e)
+    logger.warning("No desktop input library available, using the headless recording backend (no real input is sent).")
+    return RecordingInputBackend()
+
+def set_input_backend(backend):
+    """Swaps the active input backend, e.g. for a RecordingInputBackend in benchmarks."""
+    global INPUT_LIB
+    INPUT_LIB = backend
+    return backend
+
+INPUT_LIB = None
+_INPUT_LOCK = threading.Lock()
+
+def input_backend():
+    """Returns the active backend, creating the default one on first use (normally done during startup)."""
+    if INPUT_LIB is not None: return INPUT_LIB
+    with _INPUT_LOCK:
+        return INPUT_LIB or set_input_backend(create_input_backend())
+
+class InputBatcher:
+    """Collects input events submitted within the same tick and hands them to the backend as one batch."""
+    def __init__(self, tick=0.0):
+        self.tick = tick
+        self.batches = self.events = 0
+        self._pending, self._waiters, self._handle = [], [], None
+
+    def submit(self, *events, on_sent=None):
+        """Queues (operation, *args) events; the returned future resolves once they have been sent.
+        on_sent, if given, is called at that point (also when sending failed)."""
+        loop = asyncio.get_running_loop()
+        fut = loop.create_future()
+        if on_sent: fut.add_done_callback(lambda _: on_sent())
+        self._pending.extend(events); self._waiters.append(fut)
+        if self._handle is None:
+            self._handle = loop.call_later(self.tick, self._flush) if self.tick > 0 else loop.call_soon(self._flush)
+        return fut
+
+    def depth(self):
+        """Input events waiting for the next flush."""
+        return len(self._pending)
+
+    def _flush(self):
+        events, waiters = self._pending, self._waiters
+        self._pending, self._waiters, self._handle = [], [], None
+        error = None
+        try:
+            backend = input_backend()
+            if len(events) == 1: op, *args = events[0]; getattr(backend, op)(*args)
+            else: backend.batch(events)
+        except Exception as e: error = e
+        self.batches += 1; self.events += len(events)
+        for fut in waiters:
+            if fut.done(): continue
+            if error: fut.set_exception(error)
+            else: fut.set_result(None)
+
+INPUT_BATCHER = InputBatcher()
+
+gw = psutil = np = None
+_WINDOW_MODULES_LOADED = False
+
+def load_window_modules():
+    """Imports pygetwindow and psutil once; called on the window worker thread when detection starts."""
+    global gw, psutil, _WINDOW_MODULES_LOADED
+    if _WINDOW_MODULES_LOADED: return
+    _WINDOW_MODULES_LOADED = True
+    try:
+        import pygetwindow as gw
+        logger.info("pygetwindow is available for window focusing.")
+    except Exception:
+        gw = None; logger.warning("pygetwindow not found, window focusing disabled.")
+    try:
+        import psutil
+    except ImportError:
+        psutil = None; logger.warning("psutil not found, automatic game window detection disabled.")
+
+def _numpy():
+    """Imports numpy on first use; only mouse bindings need it."""
+    global np
+    if np is None:
+        try: import numpy as np
+        except ImportError: logger.warning("numpy not found, mouse movement actions disabled.")
+    return np
 
 # --- KEY ALIASES ---
 KEY_ALIASES = { "spacebar": "space", "return": "enter", "control": "ctrl" }
 
+# --- MOUSE PATHS ---
+MOUSE_ACTIONS = ("mouse_move", "mouse_drag")
+MOUSE_EASINGS = ("linear", "bezier", "humanized")
+MOUSE_TICK_SECONDS = 0.01
+MOUSE_MAX_DURATION = 10.0
+
+class MousePath:
+    """A mouse_move/mouse_drag binding compiled into per-tick integer deltas (an (n, 2) int64 array)."""
+    def __init__(self, spec):
+        if _numpy() is None: raise RuntimeError("numpy is not installed")
+        self.action = spec.get("action", "mouse_move")
+        self.x, self.y = int(spec.get("x", 0)), int(spec.get("y", 0))
+        self.absolute = bool(spec.get("absolute", False))
+        self.easing = str(spec.get("easing", "linear")).lower()
+        self.duration = min(max(float(spec.get("duration", 0.3)), 0.0), MOUSE_MAX_DURATION)
+        self.button = str(spec.get("button", "left")).lower() if self.action == "mouse_drag" else None
+        if self.action not in MOUSE_ACTIONS: raise ValueError(f"unknown action '{self.action}'")
+        if self.easing not in MOUSE_EASINGS: raise ValueError(f"unknown easing '{self.easing}', use one of {', '.join(MOUSE_EASINGS)}")
+        steps = max(1, int(round(self.duration / MOUSE_TICK_SECONDS)))
+        self.tick = self.duration / steps
+        self.t, self.progress = _ease(self.easing, steps)
+        self.rng = np.random.default_rng() if self.easing == "humanized" else None
+        # Absolute targets depend on where the cursor is when the action fires, and humanized paths are
+        # re-drawn on every replay, so only the remaining paths are computed here.
+        self.steps = None if self.absolute or self.rng else _path_deltas(self.progress, None, self.x, self.y)
+
+    def steps_from(self, origin):
+        """Per-tick (dx, dy) moves for this replay."""
+        if self.steps is not None: return self.steps
+        dx, dy = (self.x - origin[0], self.y - origin[1]) if self.absolute else (self.x, self.y)
+        progress, lateral = _jitter(self.t, self.progress, self.rng) if self.rng else (self.progress, None)
+        return _path_deltas(progress, lateral, dx, dy)
+
+    def __str__(self):
+        target = f"to ({self.x}, {self.y})" if self.absolute else f"by ({self.x}, {self.y})"
+        return f"{self.action} {target}, {self.easing}, {self.duration}s"
+
+def _ease(easing, steps):
+    """Returns (t, progress) arrays: normalized time and fraction of the way travelled per tick."""
+    t = np.arange(1, steps + 1, dtype=np.float64) / steps
+    if easing == "linear": return t, t
+    # Cubic Bezier with control points (0, 0, 1, 1): slow start, fast middle, slow stop.
+    return t, t * t * (3.0 - 2.0 * t)
+
+def _jitter(t, progress, rng):
+    """One humanized draw: a sideways random walk pinned to both ends, plus small noise along the path."""
+    envelope = np.sin(np.pi * t)
+    walk = np.cumsum(rng.normal(0.0, 1.0, t.size))
+    walk -= t * walk[-1]
+    lateral = walk / max(np.abs(walk).max(), 1.0) * 0.03 * envelope
+    progress = np.clip(progress + rng.normal(0.0, 0.004, t.size) * envelope, 0.0, 1.0)
+    progress[-1] = 1.0
+    return progress, lateral
+
+def _path_deltas(progress, lateral, dx, dy):
+    pos = np.outer(progress, (dx, dy))
+    if lateral is not None: pos += np.outer(lateral, (-dy, dx))
+    return np.diff(np.rint(pos).astype(np.int64), axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+
+# --- USER INPUT GRAMMAR ---
+USER_INPUT_ACTION = "user_input"
+USER_INPUT_VERBS = ("press", "hold")
+USER_INPUT_MAX_LENGTH = 64
+USER_INPUT_MAX_SECONDS = 30.0
+USER_INPUT_MAX_REPEAT = 50
+USER_INPUT_REPEAT_GAP = 0.05
+
+@dataclass(frozen=True, slots=True)
+class ParsedInput:
+    """One viewer command accepted by an InputGrammar."""
+    verb: str
+    key: str
+    seconds: float = 0.0
+    repeat: int = 1
+
+    def __str__(self):
+        if self.verb == "hold": return f"HOLD '{self.key.upper()}' for {self.seconds:g}s"
+        return f"PRESS '{self.key.upper()}'" + (f" x{self.repeat}" if self.repeat > 1 else "")
+
+class InputGrammar:
+    """A user_input binding: viewer text `[press|hold] <key> [amount]`, e.g. "hold w 3" or "press e x5".
+
+    parse() is one split plus set lookups and ASCII digit scans over input capped at USER_INPUT_MAX_LENGTH,
+    so it is linear and has no regex to backtrack. Keys, verbs, durations and repeats are bounded per binding.
+    """
+    def __init__(self, spec):
+        keys = spec.get("keys")
+        if isinstance(keys, str): keys = keys.split(",")
+        if not keys: raise ValueError("user_input needs a list of allowed 'keys'")
+        self.keys = frozenset(KEY_ALIASES.get(k, k) for k in (str(k).strip().lower() for k in keys) if k)
+        self.verbs = tuple(str(v).lower() for v in spec.get("verbs", USER_INPUT_VERBS))
+        if not self.verbs or any(v not in USER_INPUT_VERBS for v in self.verbs):
+            raise ValueError(f"'verbs' must be taken from {', '.join(USER_INPUT_VERBS)}")
+        self.max_seconds = min(max(float(spec.get("max_seconds", 5.0)), 0.1), USER_INPUT_MAX_SECONDS)
+        self.max_repeat = min(max(int(spec.get("max_repeat", 10)), 1), USER_INPUT_MAX_REPEAT)
+        self.default_seconds = min(1.0, self.max_seconds)
+
+    def parse(self, text):
+        """Returns a ParsedInput, or raises ValueError saying why the text was rejected."""
+        if not text or len(text) > USER_INPUT_MAX_LENGTH: raise ValueError("empty or longer than %d characters" % USER_INPUT_MAX_LENGTH)
+        tokens = text.lower().split()
+        if tokens and tokens[0] in USER_INPUT_VERBS:
+            verb = tokens.pop(0)
+            if verb not in self.verbs: raise ValueError(f"'{verb}' is not allowed here")
+        else: verb = self.verbs[0]
+        if not 1 <= len(tokens) <= 2: raise ValueError("expected [press|hold] <key> [amount]")
+        key = KEY_ALIASES.get(tokens[0], tokens[0])
+        if key not in self.keys: raise ValueError(f"key '{tokens[0]}' is not allowed here")
+        if verb == "hold":
+            seconds = _parse_seconds(tokens[1], self.max_seconds) if len(tokens) == 2 else self.default_seconds
+            return ParsedInput(verb, key, seconds=seconds)
+        return ParsedInput(verb, key, repeat=_parse_count(tokens[1], self.max_repeat) if len(tokens) == 2 else 1)
+
+    def __str__(self): return f"user input ({'/'.join(self.verbs)} {', '.join(sorted(self.keys))})"
+
+def _is_digits(token): return bool(token) and all("0" <= c <= "9" for c in token)
+
+def _parse_seconds(token, limit):
+    """"3", "2.5" or "3s", within (0, limit]."""
+    token = token[:-1] if token.endswith("s") else token
+    whole, _, frac = token.partition(".")
+    if len(token) > 6 or not _is_digits(whole) or (frac and not _is_digits(frac)): raise ValueError(f"bad duration '{token}'")
+    seconds = float(token)
+    if not 0 < seconds <= limit: raise ValueError(f"duration must be between 0 and {limit:g}s")
+    return seconds
+
+def _parse_count(token, limit):
+    """"5", "x5" or "5x", within [1, limit]."""
+    token = token[1:] if token.startswith("x") else token[:-1] if token.endswith("x") else token
+    if len(token) > 4 or not _is_digits(token): raise ValueError(f"bad repeat count '{token}'")
+    count = int(token)
+    if not 1 <= count <= limit: raise ValueError(f"repeat count must be between 1 and {limit}")
+    return count
+
+# --- BINDINGS ---
+@dataclass(frozen=True, slots=True)
+class Binding:
+    """A compiled reward binding: a key string or MousePath (or None), plus an optional per-reward sound."""
+    action: object
+    sound: str = None
+    volume: float = 1.0
+
+def compile_bindings(rewards):
+    """Normalizes reward titles and precompiles mouse paths, so an event only needs a dict lookup."""
+    compiled = {}
+    for title, spec in rewards.items():
+        action, sound, volume = spec, None, 1.0
+        if isinstance(spec, dict):
+            sound = spec.get("sound") or None
+            try: volume = min(max(float(spec.get("volume", 1.0)), 0.0), 1.0)
+            except (TypeError, ValueError): logger.warning("Invalid volume for '%s', using 1.0.", title)
+            if spec.get("action") in MOUSE_ACTIONS:
+                try: action = MousePath(spec)
+                except (ValueError, TypeError, RuntimeError) as e:
+                    logger.warning("Mouse binding for '%s' ignored: %s", title, e); action = None
+            elif spec.get("action") == USER_INPUT_ACTION:
+                try: action = InputGrammar(spec)
+                except (ValueError, TypeError) as e:
+                    logger.warning("User input binding for '%s' ignored: %s", title, e); action = None
+            else: action = spec.get("key") or None
+        if action or sound: compiled[title.strip().lower()] = Binding(action, sound, volume)
+    return MappingProxyType(compiled)
+
+def resolve_binding_ids(bindings, titles):
+    """Maps reward IDs (from the reward catalog) to bindings, so dispatch survives renames on Twitch."""
+    return MappingProxyType({rid: bindings[title.strip().lower()] for rid, title in titles.items()
+                             if title and title.strip().lower() in bindings})
+
+def _keep_sound(existing, value):
+    """Carries a per-reward sound over when a binding's action is replaced from the console."""
+    if not isinstance(existing, dict) or not existing.get("sound"): return value
+    merged = dict(value) if isinstance(value, dict) else {"key": value}
+    merged.update({k: existing[k] for k in ("sound", "volume") if k in existing})
+    return merged
+
 # --- RATE LIMITING ---
 _LAST_TRIGGER = {}
 RATE_LIMIT_SECONDS = 1.0
 
+# --- STATS ---
+STATS_WINDOWS = (("10s", 10), ("1m", 60), ("5m", 300))
+STATS_REFRESH_SECONDS = 2.0
+LOOP_LAG_INTERVAL = 0.5
+LAG_BUCKETS_MS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+WATCHDOG_STACK_DEPTH = 12
+
+class RollingCounter:
+    """Per-second buckets in a fixed ring as long as the widest stats window: constant memory and cost."""
+    def __init__(self, seconds=300):
+        self._counts, self._stamps = [0] * seconds, [0] * seconds
+        self.total = 0
+
+    def add(self, n=1):
+        sec = int(time()); i = sec % len(self._counts)
+        if self._stamps[i] != sec: self._stamps[i], self._counts[i] = sec, 0
+        self._counts[i] += n; self.total += n
+
+    def count(self, seconds):
+        now = int(time())
+        return sum(c for c, s in zip(self._counts, self._stamps) if now - seconds < s <= now)
+
+class LatencyRing:
+    """Keeps the last `size` samples (ms); percentiles are only computed when stats are shown."""
+    def __init__(self, size=1024): self._samples = deque(maxlen=size)
+
+    def add(self, ms): self._samples.append(ms)
+
+    def percentiles(self, *ps):
+        data = sorted(self._samples)
+        if not data: return "no samples"
+        return ", ".join(f"p{p} {data[min(len(data) - 1, int(len(data) * p / 100))]:.1f}" for p in ps) + " ms"
+
+class BotStats:
+    """Counters behind the `stats` console command. Only touched from the event loop."""
+    def __init__(self):
+        self.events, self.throttled, self.dropped = RollingCounter(), RollingCounter(), RollingCounter()
+        self.per_reward = Counter()
+        self.latency, self.loop_lag = LatencyRing(), LatencyRing(int(300 / LOOP_LAG_INTERVAL))
+        self.lag_histogram = [0] * (len(LAG_BUCKETS_MS) + 1)
+        self.reconnects = 0
+        self.max_loop_lag_ms = 0.0
+
+    def loop_lagged(self, ms):
+        self.loop_lag.add(ms); self.max_loop_lag_ms = max(self.max_loop_lag_ms, ms)
+        self.lag_histogram[bisect_left(LAG_BUCKETS_MS, ms)] += 1
+
+    def dispatched(self, received):
+        """Records the delay from receiving a notification to its input being handed to the batcher."""
+        if received is not None: self.latency.add((perf_counter() - received) * 1000)
+
+    def render(self, top=5):
+        rate = lambda c: " | ".join(f"{name} {c.count(secs) / secs:.2f}/s" for name, secs in STATS_WINDOWS)
+        lines = ["--- STATS ---",
+                 f"  events      {self.events.total:>7}  {rate(self.events)}",
+                 f"  throttled   {self.throttled.total:>7}  1m {self.throttled.count(60)}",
+                 f"  dropped     {self.dropped.total:>7}  1m {self.dropped.count(60)}, sounds cut {_VOICE_POOL.steals}, "
+                 f"log lines sampled out {_LOG_SAMPLER.suppressed_total}, stream events dropped {EVENT_STREAM.dropped}",
+                 f"  queues      actions {len(BACKPRESSURE.actions)}, audio {AUDIO_WORKER.depth()}, input {INPUT_BATCHER.depth()}, "
+                 f"log {_LOG_QUEUE.qsize()}, tasks {len(asyncio.all_tasks())}",
+                 f"  reconnects  {self.reconnects:>7}",
+                 f"  loop lag    {self.loop_lag.percentiles(50, 99)}, max {self.max_loop_lag_ms:.1f} ms",
+                 f"  lag hist    {self.render_lag_histogram()}",
+                 f"  latency     {self.latency.percentiles(50, 90, 99)} (event -> input)"]
+        for title, count in self.per_reward.most_common(top): lines.append(f"    {count:>7}  {title}")
+        if BACKPRESSURE.trips:
+            lines.insert(-1, f"  backpressure {BACKPRESSURE.trips:>6}  trips, {len(BACKPRESSURE.paused)} rewards paused now")
+        if WATCHDOG.reports: lines.insert(-1, f"  slow calls  {WATCHDOG.reports:>7}  (over {WATCHDOG.threshold * 1000:.0f} ms, see log)")
+        return "\n".join(lines)
+
+    def render_lag_histogram(self):
+        labels = [f"<{b}ms" for b in LAG_BUCKETS_MS] + [f">={LAG_BUCKETS_MS[-1]}ms"]
+        return " | ".join(f"{label} {n}" for label, n in zip(labels, self.lag_histogram) if n) or "no samples"
+
+STATS = BotStats()
+
+async def probe_loop_lag(interval=LOOP_LAG_INTERVAL):
+    """Sleeps `interval` in a loop; whatever it oversleeps is time the loop spent busy elsewhere."""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        STATS.loop_lagged(max(0.0, loop.time() - start - interval) * 1000)
+
+class SlowCallbackWatchdog:
+    """Opt-in thread that pings the event loop. When a ping is not answered within `threshold` it samples
+    the loop thread's stack and, once the loop is free again, logs which callback held it and for how long."""
+    def __init__(self):
+        self.threshold, self.reports = 0.0, 0
+        self._loop = self._loop_thread = self._thread = self._stop = None
+
+    def start(self, loop, threshold_ms):
+        self.stop()
+        if threshold_ms <= 0: return
+        self.threshold, self._loop, self._loop_thread = threshold_ms / 1000, loop, threading.get_ident()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Signals the thread without joining it, so a blocked ping never stalls the caller on the loop."""
+        if self._thread: self._stop.set(); self._thread = None
+
+    def _run(self, stop):
+        while not stop.is_set():
+            answered, sent = threading.Event(), perf_counter()
+            try: self._loop.call_soon_threadsafe(answered.set)
+            except RuntimeError: return  # the loop has been closed
+            if not answered.wait(self.threshold):
+                frame = sys._current_frames().get(self._loop_thread)
+                stack = traceback.extract_stack(frame) if frame else []
+                while not answered.wait(0.5):
+                    if stop.is_set(): return
+                self.reports += 1
+                logger.warning("Event loop blocked for at least %.0f ms by %s. Stack sampled at %.0f ms:\n%s",
+                               (perf_counter() - sent) * 1000, self._culprit(stack), self.threshold * 1000,
+                               "".join(traceback.format_list(stack[-WATCHDOG_STACK_DEPTH:])).rstrip())
+            stop.wait(self.threshold)
+
+    @staticmethod
+    def _culprit(stack):
+        """The first frame below asyncio's own dispatch code: the coroutine or callback that was running."""
+        marker = os.sep + "asyncio" + os.sep
+        below = [i for i, entry in enumerate(stack) if marker in entry.filename]
+        i = below[-1] + 1 if below and below[-1] + 1 < len(stack) else len(stack) - 1
+        if i < 0: return "an unknown callback"
+        return f"{stack[i].name}() at {os.path.basename(stack[i].filename)}:{stack[i].lineno}"
+
+WATCHDOG = SlowCallbackWatchdog()
+
+def configure_diagnostics(settings):
+    """Applies the "diagnostics" settings; slow_callback_ms > 0 turns the watchdog on."""
+    try: threshold_ms = float((settings.get("diagnostics") or {}).get("slow_callback_ms", 0))
+    except (TypeError, ValueError, AttributeError) as e: logger.error("Invalid 'diagnostics' settings: %s", e); return
+    WATCHDOG.start(asyncio.get_running_loop(), threshold_ms)
+
+async def stats_top(interval=STATS_REFRESH_SECONDS):
+    """`stats top`: reprints the stats until the next console line."""
+    while True:
+        print(STATS.render(top=10), flush=True); print("(press Enter to stop)", flush=True)
+        await asyncio.sleep(interval)
+
+# --- PROFILING ---
+PROFILE_DIR = "profiles"
+PROFILE_SAMPLE_INTERVAL = 0.005
+MEM_TRACE_FRAMES = 10
+MEM_TOP = 15
+
+class StackSampler:
+    """Samples every thread's stack at a fixed interval and counts them in collapsed (flamegraph) form."""
+    def __init__(self, interval=PROFILE_SAMPLE_INTERVAL):
+        self.interval, self.samples = interval, Counter()
+        self._stop, self._thread = threading.Event(), None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True); self._thread.start()
+
+    def stop(self):
+        self._stop.set(); self._thread.join()
+
+    def _run(self):
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me: continue
+                stack = []
+                while frame:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[";".join(reversed(stack))] += 1
+
+    def write(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common(): f.write(f"{stack} {count}\n")
+
+PROFILE_MODES = ("sample", "trace")
+
+class ProfileSession:
+    """`profile start|stop`: either a low-overhead StackSampler covering all threads ("sample", written as
+    <name>.folded) or deterministic cProfile on the event-loop thread ("trace", written as <name>.pstats).
+
+    The two never run together, since cProfile's per-call cost would skew the samples. Results go to
+    PROFILE_DIR and are written on an executor thread.
+    """
+    def __init__(self):
+        self._profiler = self._timer = self.mode = None
+        self.started = 0.0
+
+    @property
+    def active(self): return self.mode is not None
+
+    def start(self, seconds=None, mode="sample"):
+        """Must be called on the event-loop thread, which is the one cProfile instruments."""
+        if mode == "trace": self._profiler = cProfile.Profile(); self._profiler.enable()
+        else: self._profiler = StackSampler(); self._profiler.start()
+        self.mode, self.started = mode, perf_counter()
+        if seconds: self._timer = asyncio.get_running_loop().call_later(seconds, lambda: asyncio.ensure_future(self.stop()))
+
+    async def stop(self):
+        """Stops the session and returns the path of the written file (None if nothing was running)."""
+        if not self.active: return None
+        profiler, mode, self._profiler, self.mode = self._profiler, self.mode, None, None
+        if mode == "trace": profiler.disable()
+        if self._timer: self._timer.cancel(); self._timer = None
+        path = os.path.join(PROFILE_DIR, "profile-" + strftime("%Y%m%d-%H%M%S") + (".pstats" if mode == "trace" else ".folded"))
+        await asyncio.get_running_loop().run_in_executor(None, self._write, profiler, path)
+        logger.info("Profile of %.1f s written to %s", perf_counter() - self.started, path)
+        return path
+
+    @staticmethod
+    def _write(profiler, path):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        if isinstance(profiler, StackSampler): profiler.stop(); profiler.write(path)
+        else: profiler.dump_stats(path)
+
+PROFILER = ProfileSession()
+
+class MemorySnapshots:
+    """`mem snapshot`: the first call starts tracemalloc, later calls diff against the previous snapshot."""
+    def __init__(self): self._last = None
+
+    def snapshot(self):
+        """Blocking (runs on an executor thread). Returns the lines to print."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(MEM_TRACE_FRAMES); self._last = None
+        snap = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+        previous, self._last = self._last, snap
+        current, peak = tracemalloc.get_traced_memory()
+        header = f"Traced memory: {current / 1024:.1f} KiB (peak {peak / 1024:.1f} KiB)"
+        if previous is None: return [header, "Baseline taken; run 'mem snapshot' again to see what grew."]
+        diff = snap.compare_to(previous, "lineno")
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, "mem-" + strftime("%Y%m%d-%H%M%S") + ".txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(header + "\n"); f.writelines(f"{stat}\n" for stat in diff)
+        return [header, *(f"  {stat}" for stat in diff[:MEM_TOP]), f"Full diff written to {path}"]
+
+    def stop(self):
+        tracemalloc.stop(); self._last = None
+
+MEM_SNAPSHOTS = MemorySnapshots()
+
 # --- SOUND MANAGEMENT ---
-try:
-    pygame.mixer.pre_init(44100, -16, 2, 512)
-    pygame.mixer.init()
-    logger.info("Pygame mixer initialized successfully for sound playback.")
-except Exception as e:
-    logger.error(f"Failed to initialize pygame mixer: {e}. Sound will not be available.")
-    pygame = None
-
-def trigger_sound(sound_file):
-    if not pygame or not pygame.mixer.get_init(): return
-    full_path = os.path.abspath(sound_file)
-    if not os.path.exists(full_path):
-        logger.warning(f"Sound file not found at: {full_path}"); return
+pygame = None
+
+def init_audio():
+    """Imports pygame and opens the mixer; runs on the audio worker thread during startup."""
+    global pygame
     try:
-        pygame.mixer.stop()
+        import pygame as _pygame
+        _pygame.mixer.pre_init(44100, -16, 2, 512)
+        _pygame.mixer.init()
+        pygame = _pygame
+        logger.info("Pygame mixer initialized successfully for sound playback.")
+    except Exception as e:
+        logger.error("Failed to initialize pygame mixer: %s. Sound will not be available.", e)
+
+SOUND_CACHE_DIR = ".sound_cache"
+
+class SoundCache:
+    """LRU of decoded sounds bounded by a PCM memory budget, with an optional on-disk copy of the PCM.
+    Entries are (sound, nbytes, mtime_ns); load() reuses an entry while its file is unchanged."""
+    def __init__(self, budget_bytes=32 * 1024 * 1024, disk_cache=False):
+        self.budget_bytes, self.disk_cache = budget_bytes, disk_cache
+        self.entries = OrderedDict()
+        self.used_bytes = 0
+        self.hits = self.misses = 0
+        self.decode_ms = self.last_decode_ms = 0.0
+
+    def configure(self, budget_mb, disk_cache):
+        self.budget_bytes, self.disk_cache = int(budget_mb * 1024 * 1024), disk_cache
+        self._evict()
+
+    def get(self, sound_file):
+        entry = self.entries.get(sound_file)
+        if entry is not None:
+            self.hits += 1; self.entries.move_to_end(sound_file)
+            return entry[0]
+        self.misses += 1
+        return self.load(sound_file)
+
+    def load(self, sound_file):
+        """Decodes `sound_file` (or reads its cached PCM) unless it is cached and unchanged on disk;
+        returns None if it cannot be loaded."""
+        full_path = os.path.abspath(sound_file)
+        try: stat = os.stat(full_path)
+        except OSError:
+            logger.warning("Sound file not found at: %s", full_path); return None
+        entry = self.entries.get(sound_file)
+        if entry is not None and entry[2] == stat.st_mtime_ns:
+            self.entries.move_to_end(sound_file); return entry[0]
+        start = perf_counter()
+        sound = self._load_pcm(full_path, stat)
+        elapsed = (perf_counter() - start) * 1000
+        self.decode_ms += elapsed; self.last_decode_ms = elapsed
+        logger.debug("Loaded sound '%s' in %.1f ms", sound_file, elapsed)
+        freq, fmt, channels = pygame.mixer.get_init()
+        nbytes = int(sound.get_length() * freq * channels * (abs(fmt) // 8))
+        old = self.entries.pop(sound_file, None)
+        if old: self.used_bytes -= old[1]
+        self.entries[sound_file] = (sound, nbytes, stat.st_mtime_ns); self.used_bytes += nbytes
+        self._evict()
+        return sound
+
+    def _load_pcm(self, full_path, stat):
+        if not self.disk_cache: return pygame.mixer.Sound(full_path)
+        key = hashlib.sha1(f"{full_path}|{stat.st_mtime_ns}|{stat.st_size}|{pygame.mixer.get_init()}".encode()).hexdigest()
+        cache_path = os.path.join(SOUND_CACHE_DIR, f"{key}.pcm")
+        if os.path.exists(cache_path):
+            with open(cache_path, "rb") as f: return pygame.mixer.Sound(buffer=f.read())
         sound = pygame.mixer.Sound(full_path)
-        sound.play()
-        logger.info(f"Playing sound: {sound_file}")
+        try:
+            os.makedirs(SOUND_CACHE_DIR, exist_ok=True)
+            with open(cache_path + ".tmp", "wb") as f: f.write(sound.get_raw())
+            os.replace(cache_path + ".tmp", cache_path)
+        except OSError as e:
+            logger.debug("Could not write decoded sound cache: %s", e)
+        return sound
+
+    def _evict(self):
+        while self.used_bytes > self.budget_bytes and len(self.entries) > 1:
+            _, (_, nbytes, _) = self.entries.popitem(last=False); self.used_bytes -= nbytes
+
+    def clear(self):
+        self.entries.clear(); self.used_bytes = 0
+
+    def metrics(self):
+        return {"entries": len(self.entries), "used_kb": self.used_bytes // 1024, "budget_kb": self.budget_bytes // 1024,
+                "hits": self.hits, "misses": self.misses, "decode_ms_total": round(self.decode_ms, 1),
+                "last_decode_ms": round(self.last_decode_ms, 1)}
+
+_SOUND_CACHE = SoundCache()
+
+class VoicePool:
+    """Plays sounds on a fixed set of mixer channels; when every voice is busy, one is stolen by policy:
+    "oldest" started first, "quietest" was started with the lowest volume setting (the configured channel
+    volume, not the level actually heard). Only used on the audio worker thread."""
+    POLICIES = ("oldest", "quietest")
+
+    def __init__(self):
+        self.channels, self.started, self.volumes = [], [], []
+        self.policy = "oldest"
+        self.steals = 0
+
+    def configure(self, max_voices=8, policy="oldest"):
+        max_voices = min(max(int(max_voices), 1), 64)
+        self.policy = policy if policy in self.POLICIES else "oldest"
+        if len(self.channels) != max_voices:
+            pygame.mixer.set_num_channels(max_voices)
+            self.channels = [pygame.mixer.Channel(i) for i in range(max_voices)]
+            self.started, self.volumes = [0.0] * max_voices, [0.0] * max_voices
+
+    def reset(self):
+        for channel in self.channels: channel.stop()
+        self.channels, self.started, self.volumes = [], [], []
+
+    def play(self, sound, volume=1.0):
+        if not self.channels: self.configure()
+        for i, channel in enumerate(self.channels):
+            if not channel.get_busy(): break
+        else:
+            ranking = self.started if self.policy == "oldest" else self.volumes
+            i = min(range(len(self.channels)), key=ranking.__getitem__)
+            self.steals += 1
+        channel = self.channels[i]
+        channel.play(sound); channel.set_volume(volume)
+        self.started[i], self.volumes[i] = perf_counter(), volume
+        return i
+
+_VOICE_POOL = VoicePool()
+
+def reset_audio():
+    """Stops and drops the mixer voices; decoded sounds stay cached and are re-checked by the next preload."""
+    if not pygame or not pygame.mixer.get_init(): return
+    _VOICE_POOL.reset()
+
+def preload_sounds(config):
+    """Queues _preload_sounds on the audio worker, the only thread that touches the cache and voices."""
+    return AUDIO_WORKER.run(_preload_sounds, config)
+
+def _preload_sounds(config):
+    """Decodes configured sounds ahead of time so a redemption never decodes on the hot path. Sounds that
+    are already cached and unchanged on disk are not decoded again."""
+    if not pygame or not pygame.mixer.get_init(): return
+    start = perf_counter()
+    sound = config.sound
+    _SOUND_CACHE.configure(sound.cache_budget_mb, sound.disk_cache)
+    _VOICE_POOL.configure(sound.max_voices, sound.steal_policy)
+    files = {sound.sound_file}
+    files.update(b.sound for b in config.bindings.values())
+    for sound_file in filter(None, files):
+        try: _SOUND_CACHE.load(sound_file)
+        except Exception as e: logger.error("Could not preload sound '%s': %s", sound_file, e)
+    startup_phase("sound preload", start)
+
+def trigger_sound(sound_file, volume=1.0):
+    if not pygame or not pygame.mixer.get_init(): return
+    try:
+        sound = _SOUND_CACHE.get(sound_file)
+        if sound is None: return
+        _VOICE_POOL.play(sound, volume)
+        logger.info("Playing sound: %s", sound_file, extra={"sample": True})
     except Exception as e:
-        logger.error(f"Could not play sound with pygame.mixer.Sound: {e}")
+        logger.error("Could not play sound with pygame.mixer.Sound: %s", e)
+
+class AudioWorker:
+    """Owns all mixer work on its own thread, so decoding or mixer locks never delay key dispatch."""
+    def __init__(self):
+        self._queue, self._thread = queue.Queue(), None
+        self.played = 0
+        self.last_latency_ms = self.max_latency_ms = self.total_latency_ms = 0.0
+
+    def _run(self):
+        while True:
+            enqueued_at, fut, fn, args = self._queue.get()
+            if fn is trigger_sound:
+                latency = (perf_counter() - enqueued_at) * 1000
+                self.played += 1; self.last_latency_ms = latency; self.total_latency_ms += latency
+                self.max_latency_ms = max(self.max_latency_ms, latency)
+            try: fut.set_result(fn(*args))
+            except Exception as e:
+                logger.error("Audio worker error in %s: %s", getattr(fn, '__name__', fn), e); fut.set_result(None)
+
+    def run(self, fn, *args):
+        """Queues `fn(*args)` on the audio thread; the returned concurrent future resolves when it has run."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="audio-worker", daemon=True); self._thread.start()
+        fut = concurrent.futures.Future()
+        self._queue.put((perf_counter(), fut, fn, args))
+        return fut
+
+    def play(self, sound_file, volume=1.0): self.run(trigger_sound, sound_file, volume)
+
+    def depth(self): return self._queue.qsize()
+
+    def metrics(self):
+        avg = self.total_latency_ms / self.played if self.played else 0.0
+        return {"queued": self.depth(), "played": self.played, "last_latency_ms": round(self.last_latency_ms, 2),
+                "avg_latency_ms": round(avg, 2), "max_latency_ms": round(self.max_latency_ms, 2)}
+
+AUDIO_WORKER = AudioWorker()
 
 # --- SETTINGS MANAGEMENT ---
+SETTINGS_SAVE_DELAY = 0.5
+
+class SettingsStore:
+    """Write-behind settings file: saves within SETTINGS_SAVE_DELAY are coalesced and written on a
+    background thread via temp file + fsync + rename, keeping the previous good copy as `<file>.bak`."""
+    def __init__(self, path, delay=SETTINGS_SAVE_DELAY):
+        self.path, self.backup_path, self.delay = path, path + ".bak", delay
+        self.writes = 0
+        self.last_written = None
+        self._lock, self._write_lock = threading.Lock(), threading.Lock()
+        self._pending, self._timer = None, None
+
+    def load(self):
+        """Reads the settings file, falling back to the backup if it is missing or corrupt."""
+        for path in (self.path, self.backup_path):
+            if not os.path.exists(path): continue
+            try:
+                with open(path, "r", encoding="utf-8") as f: data = json.load(f)
+            except (OSError, ValueError) as e:
+                logger.error("Could not read %s: %s", path, e); continue
+            if path == self.backup_path: logger.warning("Recovered settings from backup %s.", path)
+            return data
+        return {}
+
+    def save(self, settings):
+        data = json.dumps(settings, ensure_ascii=False, indent=4)  # snapshot now, the dict may change later
+        with self._lock:
+            self._pending = data
+            if self._timer is None:
+                self._timer = threading.Timer(self.delay, self._flush_pending)
+                self._timer.daemon = True; self._timer.start()
+
+    def flush(self):
+        """Writes any pending change immediately (used on shutdown)."""
+        with self._lock:
+            if self._timer is not None: self._timer.cancel()
+        self._flush_pending()
+
+    def _flush_pending(self):
+        with self._lock: data, self._pending, self._timer = self._pending, None, None
+        if data is None: return
+        try: self._write(data)
+        except OSError as e: logger.error("Failed to save settings to %s: %s", self.path, e)
+
+    def _write(self, data):
+        with self._write_lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(data); f.flush(); os.fsync(f.fileno())
+            # Only a file that still parses becomes the backup; a corrupt one must not replace the last good copy.
+            if _json_intact(self.path): os.replace(self.path, self.backup_path)
+            elif os.path.exists(self.path): logger.warning("%s is unreadable; keeping %s as the backup.", self.path, self.backup_path)
+            os.replace(tmp_path, self.path)
+            self.writes += 1; self.last_written = data
+        logger.info("Settings saved to %s", self.path)
+
+def _json_intact(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f: json.load(f)
+        return True
+    except (OSError, ValueError): return False
+
+SETTINGS_STORE = SettingsStore(SETTINGS_FILE)
+
 def load_settings():
-    if os.path.exists(SETTINGS_FILE):
-        try:
-            with open(SETTINGS_FILE, "r", encoding="utf-8") as f: return json.load(f)
-        except: return {}
-    else: return {}
+    return SETTINGS_STORE.load()
 
 def save_settings(settings):
-    with open(SETTINGS_FILE, "w", encoding="utf-8") as f: json.dump(settings, f, ensure_ascii=False, indent=4)
-    logger.info(f"Settings saved to {SETTINGS_FILE}")
+    SETTINGS_STORE.save(settings)
 
 def ensure_defaults(settings):
     settings.setdefault("rewards", {"Example Reward": "space"})
@@ -115,6 +1095,206 @@ def ensure_defaults(settings):
     known_games = focus_behavior.setdefault("known_game_processes", ["RobloxPlayerBeta.exe", "cs2.exe", "dota2.exe"])
     focus_behavior["known_game_processes"] = sorted(list(set(known_games)))
 
+# --- COMPILED SETTINGS SNAPSHOT ---
+@dataclass(frozen=True, slots=True)
+class KeyBehavior:
+    hold_keys: frozenset
+    single_press_keys: frozenset
+    hold_duration: float
+    batch_window: float
+
+@dataclass(frozen=True, slots=True)
+class SoundConfig:
+    enabled: bool
+    sound_file: str
+    volume: float
+    key_first: bool
+    max_voices: int
+    steal_policy: str
+    cache_budget_mb: float
+    disk_cache: bool
+
+@dataclass(frozen=True, slots=True)
+class FocusConfig:
+    auto_focus_enabled: bool
+    manual_focus_title: str
+    known_game_processes: tuple
+
+@dataclass(frozen=True, slots=True)
+class RedemptionPolicy:
+    enabled: bool
+    refund_throttled: bool
+    refund_failed: bool
+    refund_unbound: bool
+
+@dataclass(frozen=True, slots=True)
+class BackpressureConfig:
+    enabled: bool
+    high_watermark: int
+    low_watermark: int
+    max_wait: float
+    resume_after: float
+
+@dataclass(frozen=True, slots=True)
+class BotConfig:
+    """Immutable view of the settings used on the hot path. Replaced wholesale, never mutated."""
+    bindings: MappingProxyType
+    bindings_by_id: MappingProxyType
+    key_behavior: KeyBehavior
+    sound: SoundConfig
+    focus: FocusConfig
+    redemptions: RedemptionPolicy
+    backpressure: BackpressureConfig
+
+CONFIG = None
+RELOADABLE_SECTIONS = ("rewards", "key_behavior", "sound_on_redemption", "focus_behavior", "redemption_status", "backpressure")
+
+def _section(settings, name):
+    value = settings.get(name, {})
+    if not isinstance(value, dict): raise ValueError(f"'{name}' must be an object")
+    return value
+
+def compile_settings(settings, previous=None, sections=RELOADABLE_SECTIONS):
+    """Parses and validates settings into a BotConfig. Sections not listed are reused from `previous`.
+
+    Raises ValueError for settings that are structurally wrong; single bad bindings are only skipped.
+    """
+    if previous is None: sections = RELOADABLE_SECTIONS
+    try:
+        if "rewards" in sections:
+            bindings = compile_bindings(_section(settings, "rewards"))
+            bindings_by_id = resolve_binding_ids(bindings, REWARD_CATALOG.titles())
+        else: bindings, bindings_by_id = previous.bindings, previous.bindings_by_id
+        if "key_behavior" in sections:
+            kb = _section(settings, "key_behavior")
+            key_behavior = KeyBehavior(
+                hold_keys=frozenset(str(k).lower() for k in kb.get("hold_keys", [])),
+                single_press_keys=frozenset(str(k).lower() for k in kb.get("single_press_keys", [])),
+                hold_duration=float(kb.get("hold_duration_seconds", 1.0)),
+                batch_window=max(0.0, float(kb.get("batch_window_ms", 0))) / 1000)
+        else: key_behavior = previous.key_behavior
+        if "sound_on_redemption" in sections:
+            sc = _section(settings, "sound_on_redemption")
+            sound = SoundConfig(
+                enabled=bool(sc.get("enabled")), sound_file=sc.get("sound_file") or None,
+                volume=min(max(float(sc.get("volume", 1.0)), 0.0), 1.0), key_first=sc.get("order") == "key_first",
+                max_voices=int(sc.get("max_voices", 8)), steal_policy=str(sc.get("steal_policy", "oldest")),
+                cache_budget_mb=float(sc.get("cache_budget_mb", 32)), disk_cache=bool(sc.get("disk_cache", False)))
+        else: sound = previous.sound
+        if "focus_behavior" in sections:
+            fb = _section(settings, "focus_behavior")
+            focus = FocusConfig(
+                auto_focus_enabled=bool(fb.get("auto_focus_enabled")), manual_focus_title=fb.get("manual_focus_title") or "",
+                known_game_processes=tuple(fb.get("known_game_processes", [])))
+        else: focus = previous.focus
+        if "redemption_status" in sections:
+            rs = _section(settings, "redemption_status")
+            redemptions = RedemptionPolicy(
+                enabled=bool(rs.get("enabled", False)), refund_throttled=bool(rs.get("refund_throttled", True)),
+                refund_failed=bool(rs.get("refund_failed", True)), refund_unbound=bool(rs.get("refund_unbound", False)))
+        else: redemptions = previous.redemptions
+        if "backpressure" in sections:
+            bp = _section(settings, "backpressure")
+            backpressure = BackpressureConfig(
+                enabled=bool(bp.get("enabled", False)), high_watermark=max(1, int(bp.get("high_watermark", 20))),
+                low_watermark=max(0, int(bp.get("low_watermark", 5))), max_wait=float(bp.get("max_wait_seconds", 10)),
+                resume_after=float(bp.get("resume_after_seconds", 5)))
+            if backpressure.low_watermark >= backpressure.high_watermark:
+                raise ValueError("backpressure.low_watermark must be below high_watermark")
+        else: backpressure = previous.backpressure
+    except (TypeError, AttributeError) as e:
+        raise ValueError(str(e)) from e
+    return BotConfig(bindings, bindings_by_id, key_behavior, sound, focus, redemptions, backpressure)
+
+def install_config(config, sections=RELOADABLE_SECTIONS):
+    """Swaps in a compiled snapshot by reference and refreshes the workers that depend on its sections."""
+    global CONFIG
+    CONFIG = config
+    if "key_behavior" in sections: INPUT_BATCHER.tick = config.key_behavior.batch_window
+    if "rewards" in sections or "sound_on_redemption" in sections: preload_sounds(config)
+    if "focus_behavior" in sections: _WINDOW_TRACKER.invalidate()
+
+def apply_settings(settings, *sections):
+    """Recompiles after a console edit of `sections` (all when omitted)."""
+    sections = sections or RELOADABLE_SECTIONS
+    try: install_config(compile_settings(settings, CONFIG, sections), sections)
+    except ValueError as e: logger.error("Settings not applied, they are invalid: %s", e)
+
+# --- SETTINGS HOT RELOAD ---
+SETTINGS_POLL_SECONDS = 1.0
+SETTINGS_RELOAD_DEBOUNCE = 0.2
+IN_CLOSE_WRITE, IN_MOVED_TO = 0x0008, 0x0080
+
+def reload_settings_file(settings):
+    """Re-reads the settings file and swaps the changes into the running bot. Returns the changed keys."""
+    try:
+        with open(SETTINGS_FILE, "r", encoding="utf-8") as f: text = f.read()
+    except OSError: return set()
+    if text == SETTINGS_STORE.last_written: return set()
+    try:
+        new = json.loads(text)
+        if not isinstance(new, dict): raise ValueError("the top level must be a JSON object")
+        ensure_defaults(new)
+        changed = {k for k in set(settings) | set(new) if settings.get(k) != new.get(k)}
+        sections = changed.intersection(RELOADABLE_SECTIONS)
+        config = compile_settings(new, CONFIG, sections)
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.error("Ignoring edited %s, it is invalid: %s", SETTINGS_FILE, e); return set()
+    if not changed: return changed
+    # The dict and the snapshot are swapped in the same synchronous step, so handlers never see a mix.
+    settings.clear(); settings.update(new)
+    install_config(config, sections)
+    for key in ("twitch_channel_name", "twitch_client_id", "twitch_oauth_token"):
+        if key in changed: logger.warning("'%s' changed; it is used from the next EventSub (re)connection.", key)
+    if "logging" in changed: configure_log_sinks(new)
+    if "diagnostics" in changed: configure_diagnostics(new)
+    if "history" in changed: asyncio.get_running_loop().run_in_executor(None, HISTORY.open, new)  # may join the old writer
+    logger.info("Reloaded %s: %s updated.", SETTINGS_FILE, ', '.join(sorted(changed)))
+    return changed
+
+def _inotify_watch(directory):
+    """Returns an inotify fd watching `directory` for finished writes and renames, or None if unavailable."""
+    if not sys.platform.startswith("linux"): return None
+    try:
+        import ctypes, ctypes.util
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if fd < 0: return None
+        if libc.inotify_add_watch(fd, directory.encode(), IN_CLOSE_WRITE | IN_MOVED_TO) < 0:
+            os.close(fd); return None
+        return fd
+    except (OSError, AttributeError):
+        return None
+
+def _stat_key(path):
+    try: st = os.stat(path); return st.st_mtime_ns, st.st_size
+    except OSError: return None
+
+async def watch_settings_file(settings):
+    """Hot-reloads bot_settings.json on change (inotify where available, mtime polling otherwise)."""
+    path = os.path.abspath(SETTINGS_FILE)
+    loop, changed = asyncio.get_running_loop(), asyncio.Event()
+    fd = _inotify_watch(os.path.dirname(path))
+    if fd is not None:
+        def drain():
+            try:
+                while os.read(fd, 4096): pass
+            except BlockingIOError: pass
+            changed.set()
+        loop.add_reader(fd, drain)
+    last_stat = _stat_key(path)
+    try:
+        while not STOP_EVENT.is_set():
+            if fd is not None: await changed.wait(); changed.clear()
+            else: await asyncio.sleep(SETTINGS_POLL_SECONDS)
+            if _stat_key(path) in (last_stat, None): continue
+            await asyncio.sleep(SETTINGS_RELOAD_DEBOUNCE)  # let editors finish writing
+            last_stat = _stat_key(path)
+            try: reload_settings_file(settings)
+            except Exception as e: logger.error("Settings reload failed: %s", e)
+    finally:
+        if fd is not None: loop.remove_reader(fd); os.close(fd)
+
 def initial_setup(settings):
     if not settings.get("twitch_channel_name"):
         while True:
@@ -133,7 +1313,7 @@ def initial_setup(settings):
         client_id = settings.get("twitch_client_id")
         auth_url = (f"https://id.twitch.tv/oauth2/authorize?client_id={client_id}"
                     f"&redirect_uri=http://localhost&response_type=token"
-                    f"&scope=channel:read:redemptions+user:read:broadcast")
+                    f"&scope=channel:read:redemptions+channel:manage:redemptions+user:read:broadcast")
         print("\n--- GETTING OAuth TOKEN ---")
         print(f"\nYOUR URL IS:\n{auth_url}\n")
         while True:
@@ -150,146 +1330,879 @@ def initial_setup(settings):
     return True
 
 # --- WINDOW FOCUS & KEY ACTION ---
-_active_game_window = None
+try:
+    import ctypes
+    _user32 = ctypes.windll.user32
+except Exception:
+    _user32 = None
+
+def _window_alive(win):
+    """O(1) validity check: IsWindow() on the cached handle, or a title read where there is no handle."""
+    try:
+        hwnd = getattr(win, "_hWnd", None)
+        if hwnd and _user32: return bool(_user32.IsWindow(hwnd))
+        return bool(win.title)
+    except Exception:
+        return False
+
+def _window_id(win): return getattr(win, "_hWnd", None) or win.title
+
+class WindowTracker:
+    """Caches the target window so focusing does not enumerate every window on each action."""
+    def __init__(self):
+        self.window = None
+        self.manual_window, self.manual_title = None, None
+        self.refresh = asyncio.Event()
+        self.loop = None
+
+    def wake(self):
+        """Thread-safe: the tracker is driven from the window worker, the event lives on the asyncio loop."""
+        if self.loop is not None: self.loop.call_soon_threadsafe(self.refresh.set)
+
+    def set(self, win):
+        if self.window is None or _window_id(win) != _window_id(self.window):
+            logger.info("Auto-detected game window: '%s'", win.title)
+        self.window = win
 
-async def auto_detect_game_window(known_processes):
-    global _active_game_window
+    def invalidate(self, win=None):
+        """Drops a stale handle and wakes the background detector to look for a new one."""
+        if win is None or win is self.window:
+            if self.window is not None: logger.info("Previously detected game window closed.")
+            self.window = None; self.wake()
+        if win is None or win is self.manual_window: self.manual_window = None
+
+    def auto_target(self):
+        if self.window is not None and not _window_alive(self.window): self.invalidate(self.window)
+        return self.window
+
+    def manual_target(self, title):
+        if self.manual_title == title and self.manual_window is not None and _window_alive(self.manual_window):
+            return self.manual_window
+        wins = gw.getWindowsWithTitle(title)
+        self.manual_window, self.manual_title = (wins[0] if wins else None), title
+        return self.manual_window
+
+_WINDOW_TRACKER = WindowTracker()
+
+WINDOW_CALL_BUDGET_SECONDS = 0.25  # focus work for a single action
+WINDOW_SCAN_BUDGET_SECONDS = 2.0   # one detector pass (process scan + window enumeration)
+
+class WindowWorker:
+    """Runs blocking pygetwindow/psutil calls on a dedicated daemon thread, each with a time budget.
+
+    A call that overruns its budget returns the fallback; while the thread is still stuck on it (a hung
+    game window), further calls fall back immediately instead of queueing behind it.
+    """
+    def __init__(self):
+        self.timeouts = self.skipped = 0
+        self.busy_since = None
+        self._queue, self._thread = queue.Queue(), None
+
+    def _run(self):
+        while True:
+            fut, fn, args = self._queue.get()
+            if not fut.set_running_or_notify_cancel(): continue
+            self.busy_since = perf_counter()
+            try: fut.set_result(fn(*args))
+            except BaseException as e: fut.set_exception(e)
+            finally: self.busy_since = None
+
+    async def call(self, fn, *args, budget=WINDOW_CALL_BUDGET_SECONDS, fallback=None):
+        busy_since = self.busy_since
+        if busy_since is not None and perf_counter() - busy_since > budget:
+            self.skipped += 1
+            logger.debug("Window worker is stuck on an earlier call, skipping %s.", fn.__name__)
+            return fallback
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="window-worker", daemon=True); self._thread.start()
+        fut = concurrent.futures.Future()
+        self._queue.put((fut, fn, args))
+        try: return await asyncio.wait_for(asyncio.wrap_future(fut), budget)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            logger.warning("Window call '%s' exceeded its %.0f ms budget.", fn.__name__, budget * 1000)
+            return fallback
+
+WINDOW_WORKER = WindowWorker()
+
+GAME_SCAN_FAST_SECONDS = 2.0   # while no game window is known
+GAME_SCAN_SLOW_SECONDS = 15.0  # once a window is locked, only its handle is re-validated
+PROCESS_FULL_RESYNC_SCANS = 30
+
+class ProcessScanner:
+    """Tracks running process names incrementally: only PIDs that appeared since the last scan are queried."""
+    def __init__(self):
+        self.names = {}
+        self.targets, self.matcher = (), frozenset()
+        self.scans = 0
+        self.last_scan_ms = self.total_scan_ms = 0.0
+        self.last_new_pids = 0
+
+    def reset(self):
+        self.names.clear(); self.targets, self.matcher = (), frozenset()
+
+    def set_targets(self, known_processes):
+        targets = tuple(p.lower() for p in known_processes)
+        if targets != self.targets: self.targets, self.matcher = targets, frozenset(targets)
+
+    def scan(self):
+        """Returns the set of known game process names that are currently running."""
+        start = perf_counter()
+        # Periodic full resync catches PIDs that were recycled between two scans.
+        if self.scans % PROCESS_FULL_RESYNC_SCANS == 0: self.names.clear()
+        pids, names = set(psutil.pids()), self.names
+        for pid in names.keys() - pids: del names[pid]
+        new_pids = pids - names.keys()
+        for pid in new_pids:
+            try: names[pid] = psutil.Process(pid).name().lower()
+            except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess): names[pid] = ""
+        running = self.matcher.intersection(names.values())
+        self.scans += 1; self.last_new_pids = len(new_pids)
+        self.last_scan_ms = (perf_counter() - start) * 1000; self.total_scan_ms += self.last_scan_ms
+        logger.debug("Process scan: %s PIDs, %s new, %.1f ms", len(pids), self.last_new_pids, self.last_scan_ms)
+        return running
+
+    def metrics(self):
+        avg = self.total_scan_ms / self.scans if self.scans else 0.0
+        return {"scans": self.scans, "tracked_pids": len(self.names), "last_new_pids": self.last_new_pids,
+                "last_scan_ms": round(self.last_scan_ms, 2), "avg_scan_ms": round(avg, 2)}
+
+_PROCESS_SCANNER = ProcessScanner()
+
+def _find_game_window(scanner):
+    running = scanner.scan()
+    if not running: return None
+    windows = gw.getAllWindows()
+    for proc_name in scanner.targets:
+        if proc_name in running:
+            proc_base_name = proc_name.split('.')[0]
+            for win in windows:
+                if win.title and proc_base_name in win.title.lower(): return win
+    return None
+
+def _detect_step():
+    tracker, scanner = _WINDOW_TRACKER, _PROCESS_SCANNER
+    # A live cached handle is all focus_window needs, so skip the process scan until it goes stale.
+    if tracker.auto_target() is None:
+        scanner.set_targets(CONFIG.focus.known_game_processes)
+        found_window = _find_game_window(scanner)
+        if found_window: tracker.set(found_window)
+    return tracker.window is not None
+
+async def auto_detect_game_window():
+    await WINDOW_WORKER.call(timed_phase, "window modules", load_window_modules, budget=30)
     if not gw or not psutil: return
+    tracker = _WINDOW_TRACKER
+    tracker.loop = asyncio.get_running_loop()
     while not STOP_EVENT.is_set():
-        try:
-            active_windows = gw.getAllTitles()
-            running_processes = {p.name() for p in psutil.process_iter(['name'])}
-            found_window = None
-            for proc_name in known_processes:
-                if proc_name in running_processes:
-                    proc_base_name = proc_name.split('.')[0].lower()
-                    for title in active_windows:
-                        if title and proc_base_name in title.lower():
-                            wins = gw.getWindowsWithTitle(title)
-                            if wins:
-                                found_window = wins[0]
-                                break
-                    if found_window: break
-            
-            if found_window and (_active_game_window is None or _active_game_window.title != found_window.title):
-                 _active_game_window = found_window
-                 logger.info(f"Auto-detected game window: '{found_window.title}'")
-            elif not found_window and _active_game_window is not None:
-                logger.info("Previously detected game window closed."); _active_game_window = None
+        tracker.refresh.clear()
+        locked = tracker.window is not None
+        start = perf_counter()
+        try: locked = await WINDOW_WORKER.call(_detect_step, budget=WINDOW_SCAN_BUDGET_SECONDS, fallback=locked)
         except Exception as e:
-            logger.debug(f"Error during game window auto-detection: {e}")
-        await asyncio.sleep(5)
+            logger.debug("Error during game window auto-detection: %s", e)
+        startup_phase("game window scan", start)
+        interval = GAME_SCAN_SLOW_SECONDS if locked else GAME_SCAN_FAST_SECONDS
+        try: await asyncio.wait_for(tracker.refresh.wait(), interval)
+        except asyncio.TimeoutError: pass
+
+_DETECTOR_TASK = None
+
+async def restart_detector():
+    """(Re)starts the game window detector task, cancelling the previous one."""
+    global _DETECTOR_TASK
+    if _DETECTOR_TASK is not None:
+        _DETECTOR_TASK.cancel(); await asyncio.gather(_DETECTOR_TASK, return_exceptions=True)
+    _DETECTOR_TASK = asyncio.create_task(auto_detect_game_window())
+    return _DETECTOR_TASK
+
+def _is_foreground(win):
+    hwnd = getattr(win, "_hWnd", None)
+    if hwnd and _user32: return _user32.GetForegroundWindow() == hwnd
+    try: return bool(win.isActive)
+    except Exception: return False
 
-def focus_window(settings):
-    global _active_game_window
-    if not gw: return False
-    manual_title = settings.get("focus_behavior", {}).get("manual_focus_title")
+class FocusSettle:
+    """Learns how long an activated window takes to become the foreground, instead of a fixed 50 ms sleep."""
+    def __init__(self, initial=0.05, floor=0.005, cap=0.25, alpha=0.2):
+        self.estimate, self.floor, self.cap, self.alpha = initial, floor, cap, alpha
+        self.samples = 0
+
+    def observe(self, seconds):
+        self.estimate += self.alpha * (seconds - self.estimate); self.samples += 1
+
+    async def wait(self, win):
+        """Waits until `win` is the foreground window, giving up after a budget derived from past waits."""
+        if not getattr(win, "_hWnd", None) or not _user32:
+            await asyncio.sleep(self.estimate); return
+        start = perf_counter()
+        deadline = start + min(self.cap, max(self.floor, self.estimate * 3))
+        while not _is_foreground(win) and perf_counter() < deadline: await asyncio.sleep(0.002)
+        self.observe(perf_counter() - start)
+
+_FOCUS_SETTLE = FocusSettle()
+
+FOCUS_NONE, FOCUS_FOREGROUND, FOCUS_ACTIVATED = "none", "foreground", "activated"
+
+def focus_window(focus: FocusConfig):
+    """Returns (state, window): FOCUS_FOREGROUND when nothing had to change, FOCUS_ACTIVATED after activate()."""
+    if not gw: return FOCUS_NONE, None
+    manual_title = focus.manual_focus_title
     target_win = None
     if manual_title:
-        wins = gw.getWindowsWithTitle(manual_title)
-        if wins: target_win = wins[0]
-        else: logger.warning(f"Manual focus window '{manual_title}' not found."); return False
-    elif settings.get("focus_behavior", {}).get("auto_focus_enabled") and _active_game_window:
-        try:
-            if _active_game_window.title in gw.getAllTitles(): target_win = _active_game_window
-            else: _active_game_window = None; return False
-        except: _active_game_window = None; return False
-    if not target_win: return False
+        target_win = _WINDOW_TRACKER.manual_target(manual_title)
+        if not target_win: logger.warning("Manual focus window '%s' not found.", manual_title); return FOCUS_NONE, None
+    elif focus.auto_focus_enabled:
+        target_win = _WINDOW_TRACKER.auto_target()
+    if not target_win: return FOCUS_NONE, None
+    if _is_foreground(target_win): return FOCUS_FOREGROUND, target_win
     try:
         if target_win.isMinimized: target_win.restore()
         target_win.activate()
-        logger.debug(f"Activated window: {target_win.title}")
-        return True
+        logger.debug("Activated window: %s", target_win.title)
+        return FOCUS_ACTIVATED, target_win
     except Exception as e:
-        logger.error(f"Failed to activate window '{target_win.title}': {e}")
-        return False
+        if _window_alive(target_win):
+            # pygetwindow raises on spurious failures ("Error code from Windows: 0") though the window is fine.
+            logger.debug("Activating window '%s' reported: %s", target_win.title, e)
+            return FOCUS_ACTIVATED, target_win
+        logger.error("Failed to activate window '%s': %s", target_win.title, e)
+        _WINDOW_TRACKER.invalidate(target_win)
+        return FOCUS_NONE, None
+
+async def prepare_focus(config: BotConfig):
+    state, win = await WINDOW_WORKER.call(focus_window, config.focus, fallback=(FOCUS_NONE, None))
+    if state == FOCUS_ACTIVATED:
+        await _FOCUS_SETTLE.wait(win)
+    elif state == FOCUS_NONE:
+        logger.debug("Could not focus any game window. Key press will be sent to the active window.")
 
-async def handle_key_action(key_name: str, settings: dict):
+async def handle_key_action(key_name: str, config: BotConfig, received=None, on_dispatch=None):
     key = (key_name or "").lower()
     key = KEY_ALIASES.get(key, key)
-    if not key: logger.warning("Empty key requested."); return
-    if focus_window(settings):
-        await asyncio.sleep(0.05)
-    else:
-        logger.debug("Could not focus any game window. Key press will be sent to the active window.")
-    
-    logger.debug(f"Using input lib: {getattr(INPUT_LIB, '__name__', 'pyautogui_fallback')} to send key '{key}'")
+    if not key: logger.warning("Empty key requested."); return False
+    await prepare_focus(config)
+    STATS.dispatched(received)
+
+    logger.debug("Using input backend: %s to send key '%s'", input_backend().name, key)
     try:
-        key_behavior = settings.get("key_behavior", {})
-        if key in key_behavior.get('hold_keys', []):
-            hold_time = float(key_behavior.get('hold_duration_seconds', 1.0))
-            INPUT_LIB.keyDown(key); await asyncio.sleep(hold_time); INPUT_LIB.keyUp(key)
-            logger.info(f"ACTION: HOLD/RELEASED '{key.upper()}' for {hold_time}s")
-        elif key in key_behavior.get('single_press_keys', []):
-            if hasattr(INPUT_LIB, "click") and key in ['lmb', 'rmb']:
+        key_behavior = config.key_behavior
+        hold_keys, hold_time = key_behavior.hold_keys, key_behavior.hold_duration
+        if "+" in key and len(key) > 1:
+            # Chords like "ctrl+e": every key-down goes out in one batch, the releases in reverse order.
+            combo = [KEY_ALIASES.get(k, k) for k in key.split("+") if k]
+            downs, ups = [("keyDown", k) for k in combo], [("keyUp", k) for k in reversed(combo)]
+            if any(k in hold_keys for k in combo):
+                try: await INPUT_BATCHER.submit(*downs, on_sent=on_dispatch); await asyncio.sleep(hold_time)
+                finally: await INPUT_BATCHER.submit(*ups)  # also when cancelled, or the keys stay down in the game
+                logger.info("ACTION: HOLD/RELEASED combo '%s' for %ss", key.upper(), hold_time, extra={"sample": True})
+            else:
+                await INPUT_BATCHER.submit(*downs, *ups, on_sent=on_dispatch); logger.info("ACTION: PRESS combo '%s'.", key.upper(), extra={"sample": True})
+        elif key in hold_keys:
+            try: await INPUT_BATCHER.submit(("keyDown", key), on_sent=on_dispatch); await asyncio.sleep(hold_time)
+            finally: await INPUT_BATCHER.submit(("keyUp", key))
+            logger.info("ACTION: HOLD/RELEASED '%s' for %ss", key.upper(), hold_time, extra={"sample": True})
+        elif key in key_behavior.single_press_keys:
+            if key in ['lmb', 'rmb'] and "mouse_click" in input_backend().capabilities():
                 button = 'left' if key == 'lmb' else 'right'
-                INPUT_LIB.click(button=button); logger.info(f"ACTION: CLICK {button.title()} Mouse Button.")
+                await INPUT_BATCHER.submit(("click", button), on_sent=on_dispatch); logger.info("ACTION: CLICK %s Mouse Button.", button.title(), extra={"sample": True})
             else:
-                INPUT_LIB.press(key); logger.info(f"ACTION: PRESS Key '{key.upper()}'.")
+                await INPUT_BATCHER.submit(("press", key), on_sent=on_dispatch); logger.info("ACTION: PRESS Key '%s'.", key.upper(), extra={"sample": True})
+        else:
+            logger.warning("Action for key '%s' is not defined, using fallback single press.", key.upper())
+            await INPUT_BATCHER.submit(("press", key), on_sent=on_dispatch)
+        return True
+    except Exception as e:
+        logger.error("Error while pressing key '%s': %s", key.upper(), e); return False
+
+async def handle_mouse_action(path: MousePath, config: BotConfig, received=None, on_dispatch=None):
+    backend = input_backend()
+    if "mouse_move" not in backend.capabilities():
+        logger.warning("Input backend '%s' cannot move the mouse, skipping %s.", backend.name, path); return False
+    await prepare_focus(config)
+    STATS.dispatched(received)
+    try:
+        steps = path.steps_from(backend.position() if path.absolute else None)
+        loop = asyncio.get_running_loop()
+        if path.button: backend.mouseDown(button=path.button)
+        try:
+            deadline = loop.time()
+            for dx, dy in steps:
+                if dx or dy: backend.moveRel(int(dx), int(dy))
+                if on_dispatch: on_dispatch(); on_dispatch = None
+                deadline += path.tick
+                delay = deadline - loop.time()
+                if delay > 0: await asyncio.sleep(delay)
+        finally:
+            if path.button: backend.mouseUp(button=path.button)
+        logger.info("ACTION: %s", path, extra={"sample": True})
+        return True
+    except Exception as e:
+        logger.error("Error while moving the mouse (%s): %s", path, e); return False
+
+async def handle_parsed_input(command: ParsedInput, config: BotConfig, received=None, on_dispatch=None):
+    """Runs a viewer command that already passed its binding's InputGrammar."""
+    key, caps = command.key, input_backend().capabilities()
+    if key in ("lmb", "rmb"):
+        button = "left" if key == "lmb" else "right"
+        if command.verb == "hold" and "mouse_move" not in caps:
+            logger.warning("Input backend '%s' cannot hold mouse buttons, skipping %s.", input_backend().name, command); return False
+        downs, ups = [("mouseDown", button)], [("mouseUp", button)]
+        press = [("click", button)] if "mouse_click" in caps else [("press", key)]
+    else:
+        combo = [KEY_ALIASES.get(k, k) for k in key.split("+") if k] if len(key) > 1 else [key]
+        downs, ups = [("keyDown", k) for k in combo], [("keyUp", k) for k in reversed(combo)]
+        press = downs + ups if len(combo) > 1 else [("press", key)]
+    await prepare_focus(config)
+    STATS.dispatched(received)
+    try:
+        if command.verb == "hold":
+            # Released in finally: a cancelled task (shutdown, restart) must not leave the key held in the game.
+            try: await INPUT_BATCHER.submit(*downs, on_sent=on_dispatch); await asyncio.sleep(command.seconds)
+            finally: await INPUT_BATCHER.submit(*ups)
         else:
-            logger.warning(f"Action for key '{key.upper()}' is not defined, using fallback single press.")
-            INPUT_LIB.press(key)
+            for i in range(command.repeat):
+                if i: await asyncio.sleep(USER_INPUT_REPEAT_GAP)  # separate presses, or games read one long one
+                await INPUT_BATCHER.submit(*press, on_sent=on_dispatch)
+        logger.info("ACTION: %s", command, extra={"sample": True})
+        return True
     except Exception as e:
-        logger.error(f"Error while pressing key '{key.upper()}': {e}")
+        logger.error("Error while running viewer input (%s): %s", command, e); return False
 
 # --- EVENT HANDLING & MAIN LOGIC ---
-async def handle_redemption_event(event: dict, settings: dict):
+def _once(fn, *args):
+    """Returns a callback that runs fn(*args) on its first call only; call arguments are ignored."""
+    pending = [True]
+    def fire(*_):
+        if pending: pending.clear(); fn(*args)
+    return fire
+
+async def handle_redemption_event(event: dict):
+    received = perf_counter()
     try:
-        reward_title = event.get("reward", {}).get("title")
+        reward = event.get("reward", {})
+        reward_id, reward_title = reward.get("id"), reward.get("title")
         if not reward_title:
             logger.debug("Received redemption without a reward title. Ignoring.")
-            return
+            STATS.dropped.add(); return
             
         user_name = event.get("user_name")
-        logger.info(f"EVENT RECEIVED: Reward '{reward_title}' from {user_name}.")
-        norm_title = reward_title.strip().lower()
+        logger.info("EVENT RECEIVED: Reward '%s' from %s.", reward_title, user_name, extra={"sample": True})
+        STATS.events.add(); STATS.per_reward[reward_title] += 1
+        trigger_key = reward_id or reward_title.strip().lower()
         now = time()
-        last = _LAST_TRIGGER.get(norm_title, 0)
+        last = _LAST_TRIGGER.get(trigger_key, 0)
+        config = CONFIG
+        policy = config.redemptions
         if now - last < RATE_LIMIT_SECONDS:
-            logger.info(f"Throttled reward '{reward_title}' (last trigger {now - last:.2f}s ago).")
-            return
-        _LAST_TRIGGER[norm_title] = now
-        sound_config = settings.get("sound_on_redemption", {})
-        if sound_config.get("enabled"): trigger_sound(sound_config.get("sound_file"))
+            logger.info("Throttled reward '%s' (last trigger %.2fs ago).", reward_title, now - last, extra={"sample": True})
+            STATS.throttled.add(); EVENT_STREAM.publish("throttled", reward=reward_title, user=user_name)
+            if policy.enabled and policy.refund_throttled: REDEMPTIONS.queue(event, REDEMPTION_CANCELED)
+            HISTORY.record(event, "throttled"); return
+        binding = config.bindings_by_id.get(reward_id)
+        if binding is None: binding = config.bindings.get(reward_title.strip().lower())  # not in the catalog (yet)
+        action = binding.action if binding else None
+        if isinstance(action, InputGrammar):
+            user_input = event.get("user_input") or ""
+            try: action = action.parse(user_input)
+            except ValueError as e:
+                logger.info("REJECTED: Reward '%s' input %r: %s", reward_title, user_input[:USER_INPUT_MAX_LENGTH], e, extra={"sample": True})
+                STATS.dropped.add(); EVENT_STREAM.publish("rejected", reward=reward_title, user=user_name, reason=str(e))
+                if policy.enabled and policy.refund_failed: REDEMPTIONS.queue(event, REDEMPTION_CANCELED)
+                HISTORY.record(event, "rejected"); return
+        _LAST_TRIGGER[trigger_key] = now
+        sound_config = config.sound
+        sound = None
+        if sound_config.enabled:
+            if binding and binding.sound: sound = (binding.sound, sound_config.volume * binding.volume)
+            elif sound_config.sound_file: sound = (sound_config.sound_file, sound_config.volume * (binding.volume if binding else 1.0))
+        # key_first: the sound starts once the first input has gone out (or the action ended without any).
+        play = _once(AUDIO_WORKER.play, *sound) if sound and sound_config.key_first and action else None
+        if sound and not play: AUDIO_WORKER.play(*sound)
+        def on_dispatch():
+            BACKPRESSURE.dispatched(task)
+            if play: play()
         
-        rewards = {k.strip().lower(): v for k, v in settings.get("rewards", {}).items()}
-        key_to_press = rewards.get(norm_title)
-        
-        if key_to_press:
-            logger.info(f"MATCH FOUND: Binding '{reward_title}' -> '{key_to_press}'. Triggering key press.")
-            asyncio.create_task(handle_key_action(key_to_press, settings))
+        EVENT_STREAM.publish("redemption", reward=reward_title, user=user_name, action=action, sound=sound[0] if sound else None)
+        if isinstance(action, MousePath):
+            logger.info("MATCH FOUND: Binding '%s' -> %s. Triggering mouse action.", reward_title, action, extra={"sample": True})
+            task = asyncio.create_task(handle_mouse_action(action, config, received, on_dispatch))
+        elif isinstance(action, ParsedInput):
+            logger.info("MATCH FOUND: Binding '%s' -> %s. Triggering viewer input.", reward_title, action, extra={"sample": True})
+            task = asyncio.create_task(handle_parsed_input(action, config, received, on_dispatch))
+        elif action:
+            logger.info("MATCH FOUND: Binding '%s' -> '%s'. Triggering key press.", reward_title, action, extra={"sample": True})
+            task = asyncio.create_task(handle_key_action(action, config, received, on_dispatch))
         else:
-            logger.info(f"NO KEY MATCH: Reward '{reward_title}' (sound only).")
-    except Exception as e: logger.error(f"Error processing reward event: {e}")
+            logger.info("NO KEY MATCH: Reward '%s' (sound only).", reward_title, extra={"sample": True})
+            task = None
+            if policy.enabled: REDEMPTIONS.queue(event, REDEMPTION_CANCELED if policy.refund_unbound else REDEMPTION_FULFILLED)
+            HISTORY.record(event, "sound_only")
+        if task: BACKPRESSURE.track(task); task.add_done_callback(lambda t: HISTORY.record_action(event, t, received))
+        if task and policy.enabled: task.add_done_callback(lambda t: REDEMPTIONS.settle(event, t, policy))
+        if task and play: task.add_done_callback(play)
+    except Exception as e: logger.error("Error processing reward event: %s", e); STATS.dropped.add()
 
-async def subscribe_to_events(http_session: aiohttp.ClientSession, session_id: str, settings: dict):
+def helix_headers(settings):
     token = settings['twitch_oauth_token']
-    headers = { "Client-ID": settings["twitch_client_id"], "Authorization": f"Bearer {token}", "Content-Type": "application/json" }
-    broadcaster_id = None
+    return { "Client-ID": settings["twitch_client_id"], "Authorization": f"Bearer {token}", "Content-Type": "application/json" }
+
+async def _fetch_broadcaster_id(http_session: aiohttp.ClientSession, settings: dict):
+    start = perf_counter()
     try:
-        async with http_session.get(f"https://api.twitch.tv/helix/users?login={settings['twitch_channel_name']}", headers=headers, timeout=10) as resp:
-            if resp.status != 200: logger.error(f"Failed to get user ID: {resp.status} {await resp.text()}"); return None
+        async with http_session.get(f"https://api.twitch.tv/helix/users?login={settings['twitch_channel_name']}", headers=helix_headers(settings), timeout=10) as resp:
+            if resp.status != 200: logger.error("Failed to get user ID: %s %s", resp.status, await resp.text()); return None
             data = await resp.json()
-            if not data.get("data"): logger.error(f"Channel '{settings['twitch_channel_name']}' not found."); return None
+            if not data.get("data"): logger.error("Channel '%s' not found.", settings['twitch_channel_name']); return None
             broadcaster_id = data["data"][0]["id"]
-            logger.info(f"Got Broadcaster ID: {broadcaster_id}")
+            logger.info("Got Broadcaster ID: %s", broadcaster_id)
+            return broadcaster_id
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        logger.error("HTTP error getting user ID: %s", e); return None
+    finally: startup_phase("helix broadcaster lookup", start)
+
+_BROADCASTER_LOOKUPS = {}
+
+def lookup_broadcaster_id(http_session: aiohttp.ClientSession, settings: dict):
+    """Returns a task resolving the broadcaster ID. Started at startup so it overlaps the EventSub
+    handshake; later callers share the result, failed lookups are retried."""
+    key = (settings['twitch_channel_name'], settings['twitch_client_id'], settings['twitch_oauth_token'])
+    task = _BROADCASTER_LOOKUPS.get(key)
+    if task is None or (task.done() and (task.cancelled() or task.exception() or task.result() is None)):
+        task = _BROADCASTER_LOOKUPS[key] = asyncio.ensure_future(_fetch_broadcaster_id(http_session, settings))
+    return task
+
+def action_succeeded(task):
+    return not task.cancelled() and task.exception() is None and task.result() is not False
+
+# --- REDEMPTION HISTORY ---
+HISTORY_FILE = "redemption_history.db"
+HISTORY_FLUSH_SECONDS = 1.0
+HISTORY_BATCH_SIZE = 500
+HISTORY_SCHEMA = """
+PRAGMA journal_mode = WAL;
+PRAGMA synchronous = NORMAL;
+CREATE TABLE IF NOT EXISTS redemptions (
+    id INTEGER PRIMARY KEY, ts REAL NOT NULL, user TEXT, reward TEXT NOT NULL, reward_id TEXT,
+    input TEXT, outcome TEXT NOT NULL, latency_ms REAL);
+CREATE INDEX IF NOT EXISTS idx_redemptions_ts ON redemptions (ts);
+CREATE INDEX IF NOT EXISTS idx_redemptions_user ON redemptions (user COLLATE NOCASE, ts);
+CREATE INDEX IF NOT EXISTS idx_redemptions_reward ON redemptions (reward COLLATE NOCASE, ts);
+CREATE TABLE IF NOT EXISTS user_totals (user TEXT PRIMARY KEY, count INTEGER NOT NULL, last_ts REAL) WITHOUT ROWID;
+-- Keyed by reward ID (the title for rewards without one), so renaming a reward keeps its totals.
+CREATE TABLE IF NOT EXISTS reward_totals (reward_id TEXT PRIMARY KEY, reward TEXT NOT NULL, count INTEGER NOT NULL, last_ts REAL) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_user_totals_count ON user_totals (count);
+CREATE INDEX IF NOT EXISTS idx_reward_totals_count ON reward_totals (count);
+"""
+
+class HistoryStore:
+    """Every redemption in a local SQLite database (WAL), written in batches by a background thread.
+
+    record() only appends to an in-memory deque; the writer drains it every HISTORY_FLUSH_SECONDS (or
+    at HISTORY_BATCH_SIZE rows) in one transaction and keeps the per-user and per-reward totals that
+    'top users' / 'top rewards' read. Queries open their own read connection, which WAL never blocks.
+    """
+    def __init__(self):
+        self.path, self.written, self.failed = None, 0, 0
+        self._buffer, self._wake, self._thread, self._closing = deque(), threading.Event(), None, False
+
+    def open(self, settings):
+        cfg = settings.get("history") or {}
+        path = os.path.abspath(cfg.get("path") or HISTORY_FILE)
+        if not cfg.get("enabled", True): self.close(); self.path = None; return
+        if self._thread and path == self.path: return
+        self.close()
+        try:
+            conn = sqlite3.connect(path, check_same_thread=False); conn.executescript(HISTORY_SCHEMA)
+        except sqlite3.Error as e: logger.error("Redemption history disabled, cannot open %s: %s", path, e); return
+        self.path, self._closing = path, False
+        self._thread = threading.Thread(target=self._run, args=(conn,), name="history-writer", daemon=True); self._thread.start()
+
+    def close(self):
+        """Writes what is buffered and stops the writer thread."""
+        if not self._thread: return
+        self._closing = True; self._wake.set(); self._thread.join(); self._thread = None
+
+    def record(self, event, outcome, received=None):
+        if not self._thread: return
+        reward = event.get("reward", {})
+        latency = round((perf_counter() - received) * 1000, 2) if received is not None else None
+        self._buffer.append((time(), event.get("user_name"), reward.get("title"), reward.get("id"),
+                             event.get("user_input") or None, outcome, latency))
+        if len(self._buffer) >= HISTORY_BATCH_SIZE: self._wake.set()
+
+    def record_action(self, event, task, received):
+        """Done-callback for an action task; the latency runs until the action has finished."""
+        self.record(event, "ok" if action_succeeded(task) else "failed", received)
+
+    def _run(self, conn):
+        while True:
+            self._wake.wait(HISTORY_FLUSH_SECONDS); self._wake.clear()
+            rows = []
+            while self._buffer: rows.append(self._buffer.popleft())
+            if rows: self._write(conn, rows)
+            if self._closing: conn.close(); return
+
+    def _write(self, conn, rows):
+        users, rewards = Counter(), Counter()
+        last_user, last_reward = {}, {}
+        for row in rows:
+            if row[1]: users[row[1]] += 1; last_user[row[1]] = row[0]
+            key = row[3] or row[2]
+            rewards[key] += 1; last_reward[key] = (row[2], row[0])
+        try:
+            with conn:
+                conn.executemany("INSERT INTO redemptions (ts, user, reward, reward_id, input, outcome, latency_ms) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+                conn.executemany("INSERT INTO user_totals VALUES (?, ?, ?) ON CONFLICT (user) DO UPDATE SET "
+                                 "count = count + excluded.count, last_ts = excluded.last_ts", [(u, n, last_user[u]) for u, n in users.items()])
+                conn.executemany("INSERT INTO reward_totals VALUES (?, ?, ?, ?) ON CONFLICT (reward_id) DO UPDATE SET "
+                                 "reward = excluded.reward, count = count + excluded.count, last_ts = excluded.last_ts",
+                                 [(r, last_reward[r][0], n, last_reward[r][1]) for r, n in rewards.items()])
+            self.written += len(rows)
+        except sqlite3.Error as e:
+            self.failed += len(rows); logger.error("Could not write %d history rows: %s", len(rows), e)
+
+    def query(self, sql, params=()):
+        """Blocking read (run it on an executor thread)."""
+        conn = sqlite3.connect(f"file:{self.path}?mode=ro", uri=True)
+        try: return conn.execute(sql, params).fetchall()
+        finally: conn.close()
+
+    def recent(self, limit, user=None, reward=None):
+        where, params = "", []
+        if user: where, params = "WHERE user = ? COLLATE NOCASE", [user]
+        elif reward: where, params = "WHERE reward = ? COLLATE NOCASE", [reward]
+        return self.query(f"SELECT ts, user, reward, input, outcome, latency_ms FROM redemptions {where} ORDER BY ts DESC, id DESC LIMIT ?", (*params, limit))
+
+    def top(self, table, limit):
+        column = "user" if table == "user_totals" else "reward"
+        return self.query(f"SELECT {column}, count, last_ts FROM {table} ORDER BY count DESC LIMIT ?", (limit,))
+
+    def metrics(self): return {"written": self.written, "failed": self.failed, "buffered": len(self._buffer)}
+
+HISTORY = HistoryStore()
+
+# --- REDEMPTION STATUS ---
+HELIX_REDEMPTIONS_URL = "https://api.twitch.tv/helix/channel_points/custom_rewards/redemptions"
+REDEMPTION_BATCH_SIZE = 50  # Helix accepts at most 50 redemption IDs per request
+REDEMPTION_FLUSH_SECONDS = 1.0
+REDEMPTION_FULFILLED, REDEMPTION_CANCELED = "FULFILLED", "CANCELED"
+
+class RedemptionUpdater:
+    """Marks redemptions FULFILLED or CANCELED (refunded) through Helix; needs channel:manage:redemptions.
+
+    Each request takes a single reward_id, so updates are grouped per (reward, status) and sent every
+    REDEMPTION_FLUSH_SECONDS, or at once when a group reaches REDEMPTION_BATCH_SIZE IDs.
+    """
+    def __init__(self):
+        self.http_session = self.settings = self._timer = None
+        self.requests = self.updated = self.failed = 0
+        self._pending, self._skip_rewards, self._disabled = {}, set(), False
+        self._sending = set()  # holds the batch tasks, so they are not collected mid-request and flush() can await them
+
+    def bind(self, http_session, settings):
+        self.http_session, self.settings, self._disabled = http_session, settings, False
+
+    def queue(self, event, status):
+        reward_id, redemption_id = event.get("reward", {}).get("id"), event.get("id")
+        if self.http_session is None or self._disabled or not reward_id or not redemption_id: return
+        # Rewards that skip the request queue arrive already fulfilled and cannot be changed.
+        if str(event.get("status", "unfulfilled")).lower() != "unfulfilled" or reward_id in self._skip_rewards: return
+        ids = self._pending.setdefault((reward_id, status), [])
+        ids.append(redemption_id)
+        if len(ids) >= REDEMPTION_BATCH_SIZE:
+            task = asyncio.create_task(self._send(reward_id, status, self._pending.pop((reward_id, status))))
+            self._sending.add(task); task.add_done_callback(self._sending.discard)
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(REDEMPTION_FLUSH_SECONDS, lambda: asyncio.ensure_future(self.flush()))
+
+    def settle(self, event, task, policy):
+        """Done-callback for an action task: fulfil it, or refund it if the action failed."""
+        self.queue(event, REDEMPTION_FULFILLED if action_succeeded(task) or not policy.refund_failed else REDEMPTION_CANCELED)
+
+    async def flush(self):
+        if self._timer: self._timer.cancel()
+        self._timer = None
+        pending, self._pending = self._pending, {}
+        sends = [self._send(reward_id, status, ids) for (reward_id, status), ids in pending.items()]
+        if sends or self._sending: await asyncio.gather(*sends, *self._sending)
+
+    async def _send(self, reward_id, status, ids):
+        broadcaster_id = await lookup_broadcaster_id(self.http_session, self.settings)
+        if not broadcaster_id: self.failed += len(ids); return
+        params = [("broadcaster_id", broadcaster_id), ("reward_id", reward_id)] + [("id", i) for i in ids]
+        self.requests += 1
+        try:
+            async with self.http_session.patch(HELIX_REDEMPTIONS_URL, params=params, headers=helix_headers(self.settings),
+                                               json={"status": status}, timeout=10) as resp:
+                if resp.status == 200: self.updated += len(ids); return
+                self.failed += len(ids)
+                if resp.status == 401:
+                    self._disabled = True
+                    logger.error("Redemption status updates disabled; the token needs the channel:manage:redemptions scope: %s", await resp.text())
+                elif resp.status == 403:
+                    self._skip_rewards.add(reward_id)
+                    logger.warning("Reward %s was not created with this Client ID; its redemptions cannot be updated.", reward_id)
+                else: logger.error("Failed to mark %d redemptions %s: %s %s", len(ids), status, resp.status, await resp.text())
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.failed += len(ids); logger.error("HTTP error updating redemptions: %s", e)
+
+    def metrics(self):
+        return {"requests": self.requests, "updated": self.updated, "failed": self.failed,
+                "pending": sum(len(ids) for ids in self._pending.values())}
+
+REDEMPTIONS = RedemptionUpdater()
+
+# --- REWARD CATALOG ---
+HELIX_REWARDS_URL = "https://api.twitch.tv/helix/channel_points/custom_rewards"
+REWARD_CATALOG_FILE = "reward_catalog.json"
+EVENTSUB_REDEMPTION = "channel.channel_points_custom_reward_redemption.add"
+CATALOG_EVENT_TYPES = ("channel.channel_points_custom_reward.add", "channel.channel_points_custom_reward.update",
+                       "channel.channel_points_custom_reward.remove")
+
+class RewardCatalog:
+    """The channel's custom rewards by ID. Fetched from Helix at startup, cached in REWARD_CATALOG_FILE so
+    ID dispatch works before the fetch returns, and kept current from the reward EventSub events."""
+    FIELDS = ("title", "cost", "is_enabled", "is_paused")
+
+    def __init__(self, path=REWARD_CATALOG_FILE):
+        self.path, self.rewards = path, {}
+        self._pending, self._lock, self._write_lock = None, threading.Lock(), threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f: data = json.load(f)
+            if isinstance(data, dict): self.rewards = data
+        except (OSError, ValueError): pass
+
+    def save(self):
+        """Writes the cache on an executor thread. Saves made before that write starts are coalesced,
+        and writes never overlap, so the file always ends up with the newest catalog."""
+        data = json.dumps(self.rewards, ensure_ascii=False, indent=2)
+        with self._lock: idle, self._pending = self._pending is None, data
+        if idle: asyncio.get_running_loop().run_in_executor(None, self.flush)
+
+    def flush(self):
+        """Writes any pending change now (also used on shutdown)."""
+        with self._write_lock:
+            with self._lock: data, self._pending = self._pending, None
+            if data is not None: self._write(data)
+
+    def _write(self, data):
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f: f.write(data)
+            os.replace(tmp, self.path)
+        except OSError as e: logger.error("Could not write %s: %s", self.path, e)
+
+    def titles(self): return {rid: reward.get("title") for rid, reward in self.rewards.items()}
+
+    def replace(self, rewards):
+        """Swaps in the full Helix list. Returns (old title, new title) for rewards renamed since the cache."""
+        new = {r["id"]: {k: r.get(k) for k in self.FIELDS} for r in rewards}
+        renamed = [(self.rewards[rid].get("title"), r["title"]) for rid, r in new.items()
+                   if rid in self.rewards and self.rewards[rid].get("title") not in (None, r["title"])]
+        self.rewards = new
+        return renamed
+
+    def apply_event(self, sub_type, event):
+        """Applies one reward add/update/remove event. Returns (old title, new title) for a rename, else None."""
+        rid = event.get("id")
+        if not rid: return None
+        if sub_type.endswith(".remove"): self.rewards.pop(rid, None); return None
+        old = self.rewards.get(rid, {}).get("title")
+        self.rewards[rid] = {k: event.get(k) for k in self.FIELDS}
+        return (old, event.get("title")) if old and old != event.get("title") else None
+
+REWARD_CATALOG = RewardCatalog()
+
+def _follow_renames(settings, renamed):
+    """Moves bindings to a reward's new title, so bot_settings.json keeps matching what the streamer sees."""
+    moved = False
+    for old, new in renamed:
+        key = next((k for k in settings["rewards"] if k.strip().lower() == old.strip().lower()), None)
+        if key is None or any(k.strip().lower() == new.strip().lower() for k in settings["rewards"]): continue
+        settings["rewards"][new] = settings["rewards"].pop(key); moved = True
+        logger.warning("Reward renamed on Twitch: '%s' -> '%s'; binding moved.", old, new)
+    if moved: save_settings(settings); apply_settings(settings, "rewards")
+    return moved
+
+def refresh_reward_ids():
+    """Re-resolves reward IDs after a catalog change without recompiling the rest of the snapshot."""
+    if CONFIG: install_config(replace(CONFIG, bindings_by_id=resolve_binding_ids(CONFIG.bindings, REWARD_CATALOG.titles())), ())
+
+def unbound_rewards():
+    """(title, id) of catalog rewards no binding resolves to."""
+    bound = CONFIG.bindings_by_id if CONFIG else {}
+    return sorted((reward.get("title") or "", rid) for rid, reward in REWARD_CATALOG.rewards.items() if rid not in bound)
+
+async def sync_reward_catalog(http_session: aiohttp.ClientSession, settings: dict):
+    broadcaster_id = await lookup_broadcaster_id(http_session, settings)
+    if not broadcaster_id: return False
+    start = perf_counter()
+    try:
+        async with http_session.get(HELIX_REWARDS_URL, params={"broadcaster_id": broadcaster_id}, headers=helix_headers(settings), timeout=10) as resp:
+            if resp.status != 200: logger.warning("Could not fetch custom rewards: %s %s", resp.status, await resp.text()); return False
+            rewards = (await resp.json()).get("data", [])
     except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-        logger.error(f"HTTP error getting user ID: {e}"); return None
-    body = { "type": "channel.channel_points_custom_reward_redemption.add", "version": "1", "condition": {"broadcaster_user_id": broadcaster_id}, "transport": {"method": "websocket", "session_id": session_id} }
+        logger.warning("HTTP error fetching custom rewards: %s", e); return False
+    finally: startup_phase("helix reward catalog", start)
+    renamed = REWARD_CATALOG.replace(rewards)
+    REWARD_CATALOG.save()
+    if not _follow_renames(settings, renamed): refresh_reward_ids()
+    logger.info("Reward catalog synced: %d rewards, %d unbound ('reward list unbound').", len(rewards), len(unbound_rewards()))
+    return True
+
+def handle_catalog_event(settings: dict, sub_type: str, event: dict):
+    renamed = REWARD_CATALOG.apply_event(sub_type, event)
+    REWARD_CATALOG.save()
+    if not (renamed and _follow_renames(settings, [renamed])): refresh_reward_ids()
+    logger.info("Reward %s on Twitch: '%s'.", sub_type.rsplit(".", 1)[-1], event.get("title"))
+    EVENT_STREAM.publish("reward_" + sub_type.rsplit(".", 1)[-1], reward=event.get("title"), id=event.get("id"))
+
+# --- BACKPRESSURE ---
+BACKPRESSURE_INTERVAL = 0.5
+BACKPRESSURE_RETRY_SECONDS = 10.0
+PAUSED_REWARDS_FILE = "paused_rewards.json"  # rewards this bot paused, so a restart after a crash resumes them
+ACTION_DRAIN_SECONDS = 2.0  # shutdown waits this long for running actions before cancelling them
+
+class BackpressureController:
+    """Pauses the bound custom rewards on Twitch while the local action backlog is saturated.
+
+    Trips when the in-flight actions reach the high watermark or one has waited max_wait seconds without sending
+    any input yet; a long hold that is already running is in flight, but not waiting.
+    Resumes only after the backlog has stayed at or below the low watermark for resume_after seconds, so a
+    backlog hovering around one threshold does not flap the rewards. Only rewards it paused are resumed;
+    those are kept in PAUSED_REWARDS_FILE until resumed, and a failed resume is retried.
+    """
+    def __init__(self, path=PAUSED_REWARDS_FILE):
+        self.path, self.actions, self.paused, self._skip = path, {}, set(), set()
+        self.tripped, self.trips, self._calm_since, self._retry_at = False, 0, None, 0.0
+
+    def load(self):
+        """Picks up rewards left paused by a previous run; they are resumed once the backlog is calm."""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f: paused = json.load(f)
+        except (OSError, ValueError): return
+        if isinstance(paused, list) and paused:
+            self.paused, self.tripped, self._calm_since = set(map(str, paused)), True, None
+            logger.warning("%d rewards are still paused from the last run; they will be resumed.", len(self.paused))
+
+    def _save(self, paused):
+        try:
+            if not paused:
+                if os.path.exists(self.path): os.remove(self.path)
+                return
+            with open(self.path + ".tmp", "w", encoding="utf-8") as f: json.dump(paused, f)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e: logger.error("Could not write %s: %s", self.path, e)
+
+    def track(self, task):
+        self.actions[task] = perf_counter(); task.add_done_callback(self.actions.pop)
+
+    def dispatched(self, task):
+        """Marks the action as running once its first input is out; its run time is no longer wait."""
+        if task in self.actions: self.actions[task] = None
+
+    async def drain(self, timeout=ACTION_DRAIN_SECONDS):
+        """On shutdown: waits for in-flight actions, then cancels the rest (releasing held input), so every
+        action settles its redemption while the Helix session is still bound."""
+        if not self.actions: return
+        _, late = await asyncio.wait(list(self.actions), timeout=timeout)
+        for task in late: task.cancel()
+        if late: await asyncio.gather(*late, return_exceptions=True)
+
+    def backlog(self):
+        """(in-flight actions, seconds the oldest one still waiting to dispatch has waited)."""
+        waiting = [t for t in self.actions.values() if t is not None]
+        return len(self.actions), (perf_counter() - min(waiting)) if waiting else 0.0
+
+    async def run(self, http_session: aiohttp.ClientSession, settings: dict):
+        while True:
+            await asyncio.sleep(BACKPRESSURE_INTERVAL)
+            cfg = CONFIG.backpressure
+            if not cfg.enabled:
+                if self.tripped and perf_counter() >= self._retry_at: await self.release(http_session, settings)
+                continue
+            depth, wait = self.backlog()
+            if not self.tripped:
+                if depth < cfg.high_watermark and wait < cfg.max_wait: continue
+                self.tripped, self._calm_since = True, None; self.trips += 1
+                logger.warning("Action backlog saturated (%d in flight, oldest %.1f s); pausing bound rewards.", depth, wait)
+                EVENT_STREAM.publish("backpressure", paused=True, depth=depth, wait=round(wait, 2))
+                await self._set_paused(http_session, settings, [rid for rid in CONFIG.bindings_by_id
+                                                                 if not REWARD_CATALOG.rewards.get(rid, {}).get("is_paused")], True)
+            elif depth <= cfg.low_watermark and wait < cfg.max_wait:
+                self._calm_since = self._calm_since or perf_counter()
+                if perf_counter() - self._calm_since >= cfg.resume_after and perf_counter() >= self._retry_at:
+                    logger.info("Action backlog drained (%d in flight); resuming %d rewards.", depth, len(self.paused))
+                    EVENT_STREAM.publish("backpressure", paused=False, depth=depth, wait=round(wait, 2))
+                    await self.release(http_session, settings)
+            else: self._calm_since = None
+
+    async def release(self, http_session: aiohttp.ClientSession, settings: dict):
+        """Resumes every reward this controller paused; also called on shutdown. Stays tripped, and retries
+        after BACKPRESSURE_RETRY_SECONDS, while any of them could not be resumed."""
+        if self.paused: await self._set_paused(http_session, settings, list(self.paused), False)
+        if self.paused:
+            self._retry_at = perf_counter() + BACKPRESSURE_RETRY_SECONDS
+            logger.warning("%d rewards could not be resumed; retrying in %.0f s.", len(self.paused), BACKPRESSURE_RETRY_SECONDS)
+            return False
+        self.tripped, self._calm_since = False, None
+        return True
+
+    async def _set_paused(self, http_session, settings, reward_ids, paused):
+        broadcaster_id = await lookup_broadcaster_id(http_session, settings)
+        if not broadcaster_id: return
+        headers = helix_headers(settings)
+        async def patch(rid):
+            try:
+                async with http_session.patch(HELIX_REWARDS_URL, params={"broadcaster_id": broadcaster_id, "id": rid},
+                                              headers=headers, json={"is_paused": paused}, timeout=10) as resp:
+                    if resp.status == 200:
+                        if paused: self.paused.add(rid)
+                        else: self.paused.discard(rid)
+                        if rid in REWARD_CATALOG.rewards: REWARD_CATALOG.rewards[rid]["is_paused"] = paused
+                        return
+                    if resp.status == 403: self._skip.add(rid); self.paused.discard(rid)  # another Client ID's reward, never retried
+                    logger.warning("Could not %s reward %s: %s %s", "pause" if paused else "resume", rid, resp.status, await resp.text())
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.warning("HTTP error %s reward %s: %s", "pausing" if paused else "resuming", rid, e)
+        await asyncio.gather(*(patch(rid) for rid in reward_ids if rid not in self._skip))
+        await asyncio.get_running_loop().run_in_executor(None, self._save, sorted(self.paused))
+
+BACKPRESSURE = BackpressureController()
+
+async def _create_subscription(http_session, headers, sub_type, broadcaster_id, session_id):
+    body = { "type": sub_type, "version": "1", "condition": {"broadcaster_user_id": broadcaster_id}, "transport": {"method": "websocket", "session_id": session_id} }
     try:
         async with http_session.post("https://api.twitch.tv/helix/eventsub/subscriptions", headers=headers, json=body, timeout=10) as resp:
-            if resp.status != 202: logger.error(f"Failed to create EventSub subscription: {resp.status} {await resp.text()}"); return False
-            logger.info("Successfully created EventSub subscription.")
+            if resp.status != 202: logger.error("Failed to create EventSub subscription %s: %s %s", sub_type, resp.status, await resp.text()); return False
             return True
     except (aiohttp.ClientError, asyncio.TimeoutError) as e:
-        logger.error(f"HTTP error creating subscription: {e}"); return False
+        logger.error("HTTP error creating subscription %s: %s", sub_type, e); return False
+
+async def subscribe_to_events(http_session: aiohttp.ClientSession, session_id: str, settings: dict):
+    headers = helix_headers(settings)
+    broadcaster_id = await lookup_broadcaster_id(http_session, settings)
+    if not broadcaster_id: return None
+    start = perf_counter()
+    results = await asyncio.gather(*(_create_subscription(http_session, headers, sub_type, broadcaster_id, session_id)
+                                     for sub_type in (EVENTSUB_REDEMPTION, *CATALOG_EVENT_TYPES)))
+    if not results[0]: return False
+    logger.info("Successfully created EventSub subscription.")
+    if not all(results[1:]): logger.warning("Reward catalog events are unavailable; renames are picked up on the next start.")
+    startup_phase("eventsub subscribe", start); report_startup_profile()
+    return True
 
 async def listen_to_eventsub(http_session: aiohttp.ClientSession, settings: dict):
     ws_url = "wss://eventsub.wss.twitch.tv/ws"
     reconnect_delay = 1
     while not STOP_EVENT.is_set():
         try:
+            connect_start = perf_counter()
             async with websockets.connect(ws_url, ping_interval=20, ping_timeout=20, close_timeout=5) as ws:
+                startup_phase("eventsub connect", connect_start)
                 logger.info("Connected to EventSub WebSocket.")
                 reconnect_delay = 1
                 async for message in ws:
@@ -297,146 +2210,509 @@ async def listen_to_eventsub(http_session: aiohttp.ClientSession, settings: dict
                     msg_type = data.get("metadata", {}).get("message_type")
                     if msg_type == "session_welcome":
                         session_id = data["payload"]["session"]["id"]
-                        logger.info(f"Session established: {session_id}")
+                        startup_phase("eventsub welcome", connect_start)
+                        logger.info("Session established: %s", session_id)
                         if not await subscribe_to_events(http_session, session_id, settings):
-                            logger.error("Subscription failed. Retrying connection..."); break 
-                    elif msg_type == "notification": await handle_redemption_event(data["payload"]["event"], settings)
+                            logger.error("Subscription failed. Retrying connection..."); STATS.reconnects += 1; break
+                    elif msg_type == "notification":
+                        sub_type = data["metadata"].get("subscription_type")
+                        if sub_type in CATALOG_EVENT_TYPES: handle_catalog_event(settings, sub_type, data["payload"]["event"])
+                        else: await handle_redemption_event(data["payload"]["event"])
                     elif msg_type == "session_reconnect": logger.warning("Reconnect message received. Restarting connection..."); break
         except asyncio.CancelledError: logger.info("EventSub listener task cancelled."); break
         except websockets.exceptions.ConnectionClosed as e:
             if "4001" in str(e.reason) or "4003" in str(e.reason): raise ConnectionRefusedError("Authorization failed")
-            logger.warning(f"Connection closed unexpectedly: {getattr(e, 'code', '?')}. Retrying in {reconnect_delay}s...")
-        except Exception as e: logger.error(f"Critical error in EventSub listener: {e}. Retrying in {reconnect_delay}s...")
+            logger.warning("Connection closed unexpectedly: %s. Retrying in %ss...", getattr(e, 'code', '?'), reconnect_delay)
+            STATS.reconnects += 1
+        except Exception as e: logger.error("Critical error in EventSub listener: %s. Retrying in %ss...", e, reconnect_delay); STATS.reconnects += 1
         await asyncio.sleep(reconnect_delay)
         reconnect_delay = min(reconnect_delay * 2, 60)
     STOP_EVENT.set()
 
+# --- SOFT RESTART ---
+async def soft_restart(settings):
+    """Reinitializes settings, bindings, detector and audio in place.
+
+    The EventSub websocket, its subscription and the aiohttp session are left untouched, so no
+    redemptions are missed; use 'restart hard' to rebuild everything.
+    """
+    start = perf_counter()
+    loop = asyncio.get_running_loop()  # disk work runs in the executor so EventSub keeps being served
+    await loop.run_in_executor(None, SETTINGS_STORE.flush)
+    new = await loop.run_in_executor(None, load_settings); ensure_defaults(new)
+    try: config = compile_settings(new)
+    except ValueError as e:
+        logger.error("Soft restart aborted, %s is invalid: %s", SETTINGS_FILE, e); return False
+    for key in ("twitch_channel_name", "twitch_client_id", "twitch_oauth_token"):
+        if new.get(key) != settings.get(key): logger.warning("'%s' changed; use 'restart hard' to reconnect with it.", key)
+    settings.clear(); settings.update(new)
+    configure_log_sinks(settings); configure_diagnostics(settings)
+    await loop.run_in_executor(None, HISTORY.open, settings)
+    _LAST_TRIGGER.clear()
+    AUDIO_WORKER.run(reset_audio)
+    _PROCESS_SCANNER.reset()
+    install_config(config)
+    await restart_detector()
+    logger.warning("Soft restart complete in %.1f ms (EventSub session kept).", (perf_counter() - start) * 1000)
+    return True
+
 # --- CONSOLE WORKER ---
-async def console_input_worker(settings: dict):
+CONSOLE_HELP = (
+    "",
+    "--- CONSOLE COMMANDS ---",
+    "  status                   - Show current settings",
+    "  stats [top]              - Throughput, drops, queues, loop lag and latency (top refreshes until Enter)",
+    '  reward add "name" <key>    - Add/edit a reward binding',
+    '  reward add "name" mouse_move <x> <y> [abs] [linear|bezier|humanized] [seconds]',
+    '                           - Bind a smooth mouse movement (mouse_drag holds a button)',
+    '  reward add "name" input <k1,k2,..> [max_seconds] [max_repeat]',
+    '                           - Let viewers type "hold w 3" or "press e x5" (reward must require text)',
+    '  reward remove "name"     - Remove a reward binding',
+    "  reward list [unbound]    - Channel rewards from Twitch and what they are bound to",
+    "  sound <on|off|path>      - Manage redemption sound",
+    "  sound volume <0-1>       - Master volume for redemption sounds",
+    "  sound order <sound_first|key_first> - Queue the sound before or after the key action",
+    "  sound voices <n> [oldest|quietest] - Max overlapping sounds and which one to cut",
+    '  reward sound "name" <path|none> [volume] - Per-reward sound',
+    "  focus <title>            - Manually set window title (empty to clear)",
+    "  focus auto <on|off>      - Enable/disable automatic game window detection",
+    "  focus add <process.exe>  - Add a game process to auto-detection list",
+    "  watchdog <ms|off>        - Log a stack sample when the event loop is blocked longer than ms",
+    "  profile start [seconds] [sample|trace]",
+    "                           - Profile the running bot: stack sampling (default) or cProfile",
+    "  profile stop             - Stop and write profiles/profile-<time>.folded (or .pstats)",
+    "  mem snapshot | mem stop  - tracemalloc snapshot diffed against the previous one",
+    '  history [n] [user <name>|reward "name"] - Latest redemptions from the history database',
+    "  top <users|rewards> [n]  - Most active viewers or most redeemed rewards of all time",
+    "  pause                    - Pause INFO/DEBUG logs to enter commands",
+    "  unpause                  - Resume logging",
+    "  restart                  - Reload settings, bindings, detector and audio (keeps the connection)",
+    "  restart hard             - Fully restart the bot, including the Twitch connection",
+    "  exit                     - Exit the program",
+    "--------------------------",
+    "",
+)
+
+class CommandOutput:
+    """Where a command's text goes: printed for the console, collected for control API replies.
+
+    info()/warning() also log, so the console shows them once through the log and API callers get them back.
+    """
+    def __init__(self, echo=True): self.echo, self.lines = echo, []
+
+    def print(self, text=""):
+        self.lines.append(text)
+        if self.echo: print(text, flush=True)
+
+    def info(self, msg, *args): logger.info(msg, *args); self.lines.append(msg % args if args else msg)
+
+    def warning(self, msg, *args): logger.warning(msg, *args); self.lines.append(msg % args if args else msg)
+
+    def note(self, text):
+        """Recorded for API callers only; the console already saw it in the log."""
+        self.lines.append(text)
+
+def masked_settings(settings):
+    display = settings.copy()
+    for key in ("twitch_oauth_token", "twitch_client_id"):
+        if key in display: display[key] = f"***{display[key][-4:]}"
+    if (display.get("control_api") or {}).get("token"): display["control_api"] = {**display["control_api"], "token": "***"}
+    return display
+
+def status_metrics():
+    metrics = {}
+    if psutil: metrics["process_scanner"] = _PROCESS_SCANNER.metrics()
+    if pygame:
+        metrics["sound_cache"] = {**_SOUND_CACHE.metrics(), "voices_stolen": _VOICE_POOL.steals}
+        metrics["audio_queue"] = AUDIO_WORKER.metrics()
+    if gw: metrics["window_worker"] = {"timeouts": WINDOW_WORKER.timeouts, "skipped": WINDOW_WORKER.skipped}
+    if CONFIG and CONFIG.redemptions.enabled: metrics["redemption_status"] = REDEMPTIONS.metrics()
+    if HISTORY.path: metrics["history"] = HISTORY.metrics()
+    return metrics
+
+async def execute_command(settings: dict, cmd_line: str, out: CommandOutput):
+    """Runs one console command line. Shared by the stdin console and the control API."""
     global RESTART_FLAG
-    loop = asyncio.get_running_loop()
+    parts = cmd_line.strip().split(maxsplit=1)
+    if not parts: return
+    command, arg = parts[0].lower(), (parts[1] if len(parts) > 1 else "")
+    if command not in ("help", "status", "stats"): EVENT_STREAM.publish("command", command=cmd_line.strip())
+
+    if command == "help":
+        for line in CONSOLE_HELP: out.print(line)
+    elif command == "pause": set_logging_paused(True); out.note("Logging paused.")
+    elif command == "unpause": set_logging_paused(False); out.note("Logging resumed.")
+    elif command == "stats": out.print(STATS.render())
+    elif command == "watchdog" and arg:
+        value = arg.strip().lower()
+        try: threshold_ms = 0.0 if value == "off" else float(value)
+        except ValueError: out.warning("Usage: watchdog <milliseconds|off>")
+        else:
+            settings.setdefault("diagnostics", {})["slow_callback_ms"] = threshold_ms
+            save_settings(settings); configure_diagnostics(settings)
+            if threshold_ms > 0: out.info("Slow-callback watchdog ON (%.0f ms).", threshold_ms)
+            else: out.info("Slow-callback watchdog OFF.")
+    elif command == "profile":
+        sub, *values = arg.strip().lower().split() or [""]
+        if sub == "start":
+            mode = next((v for v in values if v in PROFILE_MODES), "sample")
+            try: seconds = next((float(v) for v in values if v not in PROFILE_MODES), None)
+            except ValueError: out.warning("Usage: profile start [seconds] [sample|trace]"); return
+            if PROFILER.active: out.warning("A profile is already running; use 'profile stop'.")
+            else:
+                PROFILER.start(seconds, mode)
+                out.info("Profiling (%s) started%s.", mode, f" for {seconds:g} s" if seconds else "; use 'profile stop' to write it")
+        elif sub == "stop":
+            path = await PROFILER.stop()
+            if path: out.note(f"Profile written to {path}")
+            else: out.warning("No profile is running.")
+        else: out.warning("Usage: profile start [seconds] [sample|trace] | profile stop")
+    elif command == "mem":
+        sub = arg.strip().lower()
+        if sub == "snapshot":
+            for line in await asyncio.get_running_loop().run_in_executor(None, MEM_SNAPSHOTS.snapshot): out.print(line)
+        elif sub == "stop": MEM_SNAPSHOTS.stop(); out.info("Memory tracing stopped.")
+        else: out.warning("Usage: mem snapshot | mem stop")
+    elif command in ("history", "top"):
+        if not HISTORY.path: out.warning("Redemption history is disabled."); return
+        try:
+            tokens = shlex.split(arg)
+            limit = int(tokens.pop(0)) if tokens and tokens[0].isdigit() else None
+            if command == "top":
+                table = {"users": "user_totals", "rewards": "reward_totals"}[tokens[0].lower()]
+                limit = int(tokens[1]) if len(tokens) > 1 else (limit or 10)
+                rows = await asyncio.get_running_loop().run_in_executor(None, HISTORY.top, table, min(limit, 1000))
+                for rank, (name, count, last_ts) in enumerate(rows, 1):
+                    out.print(f"  {rank:>3}. {name or '?':<32} {count:>8}  last {strftime('%Y-%m-%d %H:%M', localtime(last_ts))}")
+            else:
+                if len(tokens) % 2: raise ValueError(tokens[-1])
+                filters = {tokens[i].lower(): tokens[i + 1] for i in range(0, len(tokens), 2)}
+                if filters.keys() - {"user", "reward"}: raise KeyError(tokens[0])
+                rows = await asyncio.get_running_loop().run_in_executor(
+                    None, HISTORY.recent, min(limit or 20, 1000), filters.get("user"), filters.get("reward"))
+                for ts, user, reward, user_input, outcome, latency in reversed(rows):
+                    extra = f" \"{user_input}\"" if user_input else ""
+                    took = f" {latency:.0f} ms" if latency is not None else ""
+                    out.print(f"  {strftime('%Y-%m-%d %H:%M:%S', localtime(ts))}  {user or '?':<20} {reward}{extra}  [{outcome}{took}]")
+            if not rows: out.print("  (no redemptions recorded yet)")
+        except (IndexError, KeyError, ValueError): out.warning('Usage: history [n] [user <name>|reward "name"] | top <users|rewards> [n]')
+        except sqlite3.Error as e: out.warning("History query failed: %s", e)
+    elif command == "status":
+        out.print(json.dumps(masked_settings(settings), ensure_ascii=False, indent=4))
+        metrics = status_metrics()
+        if "process_scanner" in metrics: out.print(f"Process scanner: {json.dumps(metrics['process_scanner'])}")
+        if pygame:
+            out.print(f"Sound cache: {json.dumps(_SOUND_CACHE.metrics())}, voices stolen: {_VOICE_POOL.steals}")
+            out.print(f"Audio queue: {json.dumps(metrics['audio_queue'])}")
+        if gw: out.print(f"Window worker: {WINDOW_WORKER.timeouts} timeouts, {WINDOW_WORKER.skipped} skipped while stuck")
+        if "redemption_status" in metrics: out.print(f"Redemption status: {json.dumps(metrics['redemption_status'])}")
+        if "history" in metrics: out.print(f"History: {json.dumps(metrics['history'])}")
+
+    elif command == "reward":
+        try:
+            tokens = shlex.split(arg)
+            if not tokens: raise ValueError
+            action = tokens[0].lower()
+            if action == "add" and len(tokens) >= 5 and tokens[2].lower() in MOUSE_ACTIONS:
+                reward_name, spec = tokens[1], {"action": tokens[2].lower(), "x": int(tokens[3]), "y": int(tokens[4])}
+                for opt in tokens[5:]:
+                    if opt.lower() == "abs": spec["absolute"] = True
+                    elif opt.lower() in MOUSE_EASINGS: spec["easing"] = opt.lower()
+                    elif opt.lower() in ("left", "right", "middle"): spec["button"] = opt.lower()
+                    else: spec["duration"] = float(opt)
+                path = MousePath(spec)
+                settings["rewards"][reward_name] = _keep_sound(settings["rewards"].get(reward_name), spec)
+                save_settings(settings); apply_settings(settings, "rewards"); out.info("Reward '%s' bound to %s.", reward_name, path)
+            elif action == "add" and len(tokens) >= 4 and tokens[2].lower() == "input":
+                reward_name, spec = tokens[1], {"action": USER_INPUT_ACTION, "keys": tokens[3].split(",")}
+                if len(tokens) >= 5: spec["max_seconds"] = float(tokens[4])
+                if len(tokens) >= 6: spec["max_repeat"] = int(tokens[5])
+                grammar = InputGrammar(spec)
+                settings["rewards"][reward_name] = _keep_sound(settings["rewards"].get(reward_name), spec)
+                save_settings(settings); apply_settings(settings, "rewards"); out.info("Reward '%s' bound to %s.", reward_name, grammar)
+            elif action == "add" and len(tokens) >= 3:
+                reward_name, key_to_bind = tokens[1], tokens[2]
+                settings["rewards"][reward_name] = _keep_sound(settings["rewards"].get(reward_name), key_to_bind)
+                save_settings(settings); apply_settings(settings, "rewards"); out.info("Reward '%s' bound to '%s'.", reward_name, key_to_bind)
+            elif action == "sound" and len(tokens) >= 3:
+                reward_name, sound_file = tokens[1], tokens[2]
+                found_key = next((k for k in settings["rewards"] if k.strip().lower() == reward_name.strip().lower()), reward_name)
+                existing = settings["rewards"].get(found_key)
+                spec = dict(existing) if isinstance(existing, dict) else ({"key": existing} if existing else {})
+                if sound_file.lower() in ("none", "off"): spec.pop("sound", None); spec.pop("volume", None)
+                else:
+                    spec["sound"] = sound_file
+                    if len(tokens) >= 4: spec["volume"] = min(max(float(tokens[3]), 0.0), 1.0)
+                settings["rewards"][found_key] = spec
+                save_settings(settings); apply_settings(settings, "rewards")
+                out.info("Reward '%s' sound set to: %s", found_key, spec.get('sound', 'default'))
+            elif action == "list":
+                unbound = {rid for _, rid in unbound_rewards()}
+                only_unbound = len(tokens) > 1 and tokens[1].lower() == "unbound"
+                if not REWARD_CATALOG.rewards: out.print("Reward catalog is empty (not synced with Twitch yet).")
+                for rid, reward in sorted(REWARD_CATALOG.rewards.items(), key=lambda item: (item[1].get("title") or "").lower()):
+                    if only_unbound and rid not in unbound: continue
+                    state = "unbound" if rid in unbound else str(CONFIG.bindings_by_id[rid].action)
+                    paused = " (paused)" if reward.get("is_paused") else ""
+                    out.print(f"  {reward.get('title')!r:<32} {reward.get('cost') or '?':>6} pts  {state}{paused}")
+            elif action == "remove" and len(tokens) >= 2:
+                reward_name_to_remove = tokens[1]
+                found_key = None
+                norm_remove_name = reward_name_to_remove.strip().lower()
+                for k in list(settings.get("rewards", {}).keys()):
+                    if k.strip().lower() == norm_remove_name:
+                        found_key = k; break
+                if found_key:
+                    del settings["rewards"][found_key]; save_settings(settings); apply_settings(settings, "rewards")
+                    out.info("Removed reward binding for '%s'.", found_key)
+                else:
+                    out.warning("Reward '%s' not found.", reward_name_to_remove)
+            else:
+                raise ValueError
+        except Exception:
+            out.warning('Format: reward add/remove "Reward Name" <key> | reward add "Reward Name" <mouse_move|mouse_drag> <x> <y> [abs] [easing] [seconds] | reward add "Reward Name" input <keys> [max_seconds] [max_repeat] | reward sound "Reward Name" <path|none> [volume]')
+    
+    elif command == "sound" and arg:
+        param = arg.strip()
+        if "sound_on_redemption" not in settings: settings["sound_on_redemption"] = {}
+        sub, _, value = param.partition(" ")
+        if param.lower() == "on": settings["sound_on_redemption"]["enabled"] = True; out.info("Sound on redemption ENABLED.")
+        elif param.lower() == "off": settings["sound_on_redemption"]["enabled"] = False; out.info("Sound on redemption DISABLED.")
+        elif sub.lower() == "order" and value.lower() in ("sound_first", "key_first"):
+            settings["sound_on_redemption"]["order"] = value.lower(); out.info("Redemption order set to: %s", value.lower())
+        elif sub.lower() == "volume":
+            try: settings["sound_on_redemption"]["volume"] = min(max(float(value), 0.0), 1.0); out.info("Sound volume set to %s.", settings['sound_on_redemption']['volume'])
+            except ValueError: out.warning("Usage: sound volume <0.0-1.0>")
+        elif sub.lower() == "voices":
+            opts = value.split()
+            try:
+                settings["sound_on_redemption"]["max_voices"] = int(opts[0])
+                if len(opts) > 1 and opts[1].lower() in VoicePool.POLICIES: settings["sound_on_redemption"]["steal_policy"] = opts[1].lower()
+                out.info("Sound voices set to %s (%s stealing).", opts[0], settings['sound_on_redemption'].get('steal_policy', 'oldest'))
+            except (IndexError, ValueError): out.warning("Usage: sound voices <count> [oldest|quietest]")
+        else: settings["sound_on_redemption"]["sound_file"] = param; out.info("Sound file set to: %s", param)
+        save_settings(settings); apply_settings(settings, "sound_on_redemption")
+    
+    elif command == "focus":
+        val = arg.strip()
+        if not val:
+            settings["focus_behavior"]["manual_focus_title"] = ""
+            save_settings(settings); apply_settings(settings, "focus_behavior"); out.info("Manual focus title cleared.")
+        else:
+            parts = val.split(maxsplit=1)
+            sub = parts[0].lower()
+            rest = parts[1] if len(parts) > 1 else ""
+            if sub == "auto":
+                if rest.lower() == "on": settings["focus_behavior"]["auto_focus_enabled"] = True; out.info("Auto-focus ENABLED.")
+                elif rest.lower() == "off": settings["focus_behavior"]["auto_focus_enabled"] = False; out.info("Auto-focus DISABLED.")
+                else: out.warning("Usage: focus auto <on|off>")
+            elif sub == "add":
+                if rest and rest.endswith(".exe"):
+                    lst = settings["focus_behavior"].setdefault("known_game_processes", [])
+                    if rest not in lst:
+                        lst.append(rest); out.info("Process '%s' added to auto-detection.", rest)
+                    else:
+                        out.info("Process '%s' already in list.", rest)
+                else: out.warning("Usage: focus add <process.exe>")
+            else:
+                settings["focus_behavior"]["manual_focus_title"] = val
+                out.info("Manual window focus title set to: '%s'", val)
+            save_settings(settings); apply_settings(settings, "focus_behavior")
+
+    elif command == "restart":
+        if arg.strip().lower() == "hard": out.warning("Restarting bot..."); RESTART_FLAG = True; STOP_EVENT.set()
+        else: out.note("Soft restart complete." if await soft_restart(settings) else "Soft restart failed, see the log.")
+    elif command == "exit": out.info("Exiting on command..."); RESTART_FLAG = False; STOP_EVENT.set()
+    else: out.warning("Unknown command: '%s'. Type 'help' for assistance.", command)
+
+class ConsoleReader:
+    """Reads stdin on its own daemon thread and queues the lines for the loop. No executor thread is
+    parked in input(), and an exit or restart from the control API never has to wait for Enter.
+
+    It reads the unbuffered raw stream: a daemon thread blocked inside sys.stdin's buffered reader holds
+    its lock, which aborts the interpreter at shutdown.
+    """
+    def __init__(self): self.lines, self._thread = None, None
+
+    def start(self, loop):
+        if self._thread: return
+        self.lines = asyncio.Queue()
+        self._thread = threading.Thread(target=self._run, args=(loop,), name="console-reader", daemon=True)
+        self._thread.start()
+
+    def _run(self, loop):
+        if sys.stdin is None: return
+        raw, encoding = sys.stdin.buffer.raw, sys.stdin.encoding or "utf-8"
+        while True:
+            print("> " if not PAUSE_LOGGING else "(PAUSED) > ", end="", flush=True)
+            try: data = raw.readline()
+            except (OSError, ValueError): data = b""
+            if not data: logger.info("Console input closed; the control API still accepts commands."); return
+            line = data.decode(encoding, errors="replace").rstrip("\r\n")
+            try: loop.call_soon_threadsafe(self.lines.put_nowait, line)
+            except RuntimeError: return  # the loop has been closed
+
+CONSOLE_READER = ConsoleReader()
+
+async def console_input_worker(settings: dict):
+    CONSOLE_READER.start(asyncio.get_running_loop())
     logger.info("Control console is active. Type 'help' for a list of commands.")
+    top_task = None
     try:
         while not STOP_EVENT.is_set():
-            cmd_line = await loop.run_in_executor(None, lambda: input("> " if not PAUSE_LOGGING else "(PAUSED) > "))
+            cmd_line = await CONSOLE_READER.lines.get()
             if STOP_EVENT.is_set(): break
-            parts = cmd_line.strip().split(maxsplit=1)
-            if not parts: continue
-            command, arg = parts[0].lower(), (parts[1] if len(parts) > 1 else "")
-            
-            if command == "help":
-                print("\n--- CONSOLE COMMANDS ---", flush=True)
-                print("  status                   - Show current settings", flush=True)
-                print('  reward add "name" <key>    - Add/edit a reward binding', flush=True)
-                print('  reward remove "name"     - Remove a reward binding', flush=True)
-                print("  sound <on|off|path>      - Manage redemption sound", flush=True)
-                print("  focus <title>            - Manually set window title (empty to clear)", flush=True)
-                print("  focus auto <on|off>      - Enable/disable automatic game window detection", flush=True)
-                print("  focus add <process.exe>  - Add a game process to auto-detection list", flush=True)
-                print("  pause                    - Pause INFO/DEBUG logs to enter commands", flush=True)
-                print("  unpause                  - Resume logging", flush=True)
-                print("  restart                  - Restart the bot", flush=True)
-                print("  exit                     - Exit the program", flush=True)
-                print("--------------------------\n", flush=True)
-            elif command == "pause": set_logging_paused(True)
-            elif command == "unpause": set_logging_paused(False)
-            elif command == "status":
-                display = settings.copy()
-                if 'twitch_oauth_token' in display: display['twitch_oauth_token'] = f"***{display['twitch_oauth_token'][-4:]}"
-                if 'twitch_client_id' in display: display['twitch_client_id'] = f"***{display['twitch_client_id'][-4:]}"
-                print(json.dumps(display, ensure_ascii=False, indent=4), flush=True)
-            
-            elif command == "reward":
-                try:
-                    tokens = shlex.split(arg)
-                    if not tokens: raise ValueError
-                    action = tokens[0].lower()
-                    if action == "add" and len(tokens) >= 3:
-                        reward_name, key_to_bind = tokens[1], tokens[2]
-                        settings["rewards"][reward_name] = key_to_bind
-                        save_settings(settings); logger.info(f"Reward '{reward_name}' bound to '{key_to_bind}'.")
-                    elif action == "remove" and len(tokens) >= 2:
-                        reward_name_to_remove = tokens[1]
-                        found_key = None
-                        norm_remove_name = reward_name_to_remove.strip().lower()
-                        for k in list(settings.get("rewards", {}).keys()):
-                            if k.strip().lower() == norm_remove_name:
-                                found_key = k; break
-                        if found_key:
-                            del settings["rewards"][found_key]; save_settings(settings)
-                            logger.info(f"Removed reward binding for '{found_key}'.")
-                        else:
-                            logger.warning(f"Reward '{reward_name_to_remove}' not found.")
-                    else:
-                        raise ValueError
-                except Exception:
-                    logger.warning('Format: reward add/remove "Reward Name" <key>')
-            
-            elif command == "sound" and arg:
-                param = arg.strip()
-                if "sound_on_redemption" not in settings: settings["sound_on_redemption"] = {}
-                if param.lower() == "on": settings["sound_on_redemption"]["enabled"] = True; logger.info("Sound on redemption ENABLED.")
-                elif param.lower() == "off": settings["sound_on_redemption"]["enabled"] = False; logger.info("Sound on redemption DISABLED.")
-                else: settings["sound_on_redemption"]["sound_file"] = param; logger.info(f"Sound file set to: {param}")
-                save_settings(settings)
-            
-            elif command == "focus":
-                val = arg.strip()
-                if not val:
-                    settings["focus_behavior"]["manual_focus_title"] = ""
-                    save_settings(settings); logger.info("Manual focus title cleared.")
-                else:
-                    parts = val.split(maxsplit=1)
-                    sub = parts[0].lower()
-                    rest = parts[1] if len(parts) > 1 else ""
-                    if sub == "auto":
-                        if rest.lower() == "on": settings["focus_behavior"]["auto_focus_enabled"] = True; logger.info("Auto-focus ENABLED.")
-                        elif rest.lower() == "off": settings["focus_behavior"]["auto_focus_enabled"] = False; logger.info("Auto-focus DISABLED.")
-                        else: logger.warning("Usage: focus auto <on|off>")
-                    elif sub == "add":
-                        if rest and rest.endswith(".exe"):
-                            lst = settings["focus_behavior"].setdefault("known_game_processes", [])
-                            if rest not in lst:
-                                lst.append(rest); logger.info(f"Process '{rest}' added to auto-detection.")
-                            else:
-                                logger.info(f"Process '{rest}' already in list.")
-                        else: logger.warning("Usage: focus add <process.exe>")
-                    else:
-                        settings["focus_behavior"]["manual_focus_title"] = val
-                        logger.info(f"Manual window focus title set to: '{val}'")
-                    save_settings(settings)
-
-            elif command == "restart": logger.warning("Restarting bot..."); RESTART_FLAG = True; STOP_EVENT.set()
-            elif command == "exit": logger.info("Exiting on command..."); RESTART_FLAG = False; STOP_EVENT.set()
-            else: logger.warning(f"Unknown command: '{command}'. Type 'help' for assistance.")
+            if top_task: top_task.cancel(); top_task = None
+            if cmd_line.strip().lower() == "stats top": top_task = asyncio.create_task(stats_top()); continue
+            await execute_command(settings, cmd_line, CommandOutput())
     except asyncio.CancelledError: pass
-    finally: logger.info("Console worker stopped.")
+    finally:
+        if top_task: top_task.cancel()
+        logger.info("Console worker stopped.")
+
+# --- CONTROL API ---
+CONTROL_API_HOST = "127.0.0.1"
+CONTROL_API_PORT = 8765
+LOCAL_ORIGIN_HOSTS = frozenset({"localhost", "127.0.0.1", "::1"})
+EVENT_STREAM_QUEUE = 256
+
+class EventStream:
+    """Fans bot events out to control API websocket clients. Each event is serialized once; every client
+    has a bounded queue and loses its oldest events instead of slowing the bot down."""
+    def __init__(self, size=EVENT_STREAM_QUEUE):
+        self.size, self.clients, self.dropped = size, set(), 0
+
+    def subscribe(self):
+        q = asyncio.Queue(self.size); self.clients.add(q); return q
+
+    def unsubscribe(self, q): self.clients.discard(q)
+
+    def publish(self, kind, **fields):
+        if not self.clients: return
+        payload = json.dumps({"type": kind, "ts": round(time(), 3), **fields}, ensure_ascii=False, default=str)
+        for q in self.clients: self.offer(q, payload)
+
+    def offer(self, q, payload):
+        if q.full(): q.get_nowait(); self.dropped += 1
+        q.put_nowait(payload)
+
+EVENT_STREAM = EventStream()
+
+async def start_control_api(settings: dict):
+    """Starts the localhost control API when control_api.enabled is set. Returns the runner to clean up.
+
+    GET /status, GET /stats, POST /command {"command": "<console line>"} and GET /events (websocket: the
+    live event stream; text frames sent by the client are run as commands). control_api.token must be
+    sent as "Authorization: Bearer <token>" or ?token=; one is generated and saved when none is set.
+    Requests carrying a non-localhost Origin are refused, so web pages cannot drive the bot.
+    """
+    cfg = settings.get("control_api") or {}
+    if not cfg.get("enabled"): return None
+    from aiohttp import web
+    token = str(cfg.get("token") or "")
+    if not token:
+        token = secrets.token_urlsafe(24)
+        settings["control_api"] = {**cfg, "token": token}; save_settings(settings)
+        logger.warning("Generated a control API token; it is stored as control_api.token in %s.", SETTINGS_FILE)
+
+    @web.middleware
+    async def authorize(request, handler):
+        origin = request.headers.get("Origin")
+        if origin is not None and urlsplit(origin).hostname not in LOCAL_ORIGIN_HOSTS: raise web.HTTPForbidden()
+        sent = request.headers.get("Authorization", "").removeprefix("Bearer ") or request.query.get("token", "")
+        if not hmac.compare_digest(sent.encode(), token.encode()): raise web.HTTPUnauthorized()
+        return await handler(request)
+
+    async def status(request):
+        return web.json_response({"settings": masked_settings(settings), "metrics": status_metrics(), "paused": PAUSE_LOGGING})
+
+    async def stats(request): return web.json_response({"text": STATS.render(top=20)})
+
+    async def command(request):
+        # Requiring JSON keeps browsers from posting here cross-site without a CORS preflight.
+        if request.content_type != "application/json": raise web.HTTPUnsupportedMediaType()
+        try: line = (await request.json())["command"]
+        except (ValueError, KeyError, TypeError): raise web.HTTPBadRequest(text='expected {"command": "..."}')
+        out = CommandOutput(echo=False)
+        await execute_command(settings, str(line), out)
+        return web.json_response({"output": out.lines})
+
+    async def events(request):
+        ws = web.WebSocketResponse(heartbeat=30); await ws.prepare(request)
+        q = EVENT_STREAM.subscribe()
+        async def pump():
+            while True: await ws.send_str(await q.get())
+        sender = asyncio.create_task(pump())
+        try:
+            async for msg in ws:
+                if msg.type != aiohttp.WSMsgType.TEXT: continue
+                out = CommandOutput(echo=False)
+                await execute_command(settings, msg.data, out)
+                EVENT_STREAM.offer(q, json.dumps({"type": "reply", "command": msg.data, "output": out.lines}, ensure_ascii=False))
+        finally:
+            sender.cancel(); EVENT_STREAM.unsubscribe(q)
+        return ws
+
+    app = web.Application(middlewares=[authorize])
+    app.add_routes([web.get("/status", status), web.get("/stats", stats), web.post("/command", command), web.get("/events", events)])
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    port = int(cfg.get("port", CONTROL_API_PORT))
+    try: await web.TCPSite(runner, CONTROL_API_HOST, port).start()
+    except OSError as e:
+        logger.error("Control API could not listen on %s:%s: %s", CONTROL_API_HOST, port, e); await runner.cleanup(); return None
+    logger.info("Control API listening on http://%s:%s", CONTROL_API_HOST, port)
+    return runner
 
 # --- MAIN EXECUTION BLOCK ---
 async def main():
     global RESTART_FLAG
     logger.warning("=" * 60); logger.warning("Bot is starting..."); logger.warning("=" * 60)
+    startup_phase("module imports", _PROCESS_START)
+    loop = asyncio.get_running_loop()
+    # Mixer init and the input/window libraries load on their worker threads while the bot connects.
+    AUDIO_WORKER.run(timed_phase, "audio init (pygame)", init_audio)
+    loop.run_in_executor(None, timed_phase, "input backend", input_backend)
+    lag_task = asyncio.create_task(probe_loop_lag())
     while True:
         RESTART_FLAG = False; STOP_EVENT.clear()
+        start = perf_counter()
         settings = load_settings()
         ensure_defaults(settings)
+        configure_log_sinks(settings)
         if not all(k in settings for k in ["twitch_channel_name", "twitch_oauth_token", "twitch_client_id"]) or \
            not settings.get("twitch_channel_name") or not settings.get("twitch_oauth_token"):
             if not initial_setup(settings): logger.info("Setup cancelled. Exiting."); return
         
-        detector_task = asyncio.create_task(auto_detect_game_window(settings["focus_behavior"]["known_game_processes"]))
+        REWARD_CATALOG.load(); BACKPRESSURE.load()
+        try: install_config(compile_settings(settings))
+        except ValueError as e: logger.error("Invalid settings in %s: %s", SETTINGS_FILE, e); return
+        configure_diagnostics(settings)
+        HISTORY.open(settings)
+        startup_phase("settings + bindings", start)
+        await restart_detector()
+        watcher_task = asyncio.create_task(watch_settings_file(settings))
+        api_runner = await start_control_api(settings)
         async with aiohttp.ClientSession() as http_session:
+            lookup_broadcaster_id(http_session, settings)
+            REDEMPTIONS.bind(http_session, settings)
+            catalog_task = asyncio.create_task(sync_reward_catalog(http_session, settings))
+            backpressure_task = asyncio.create_task(BACKPRESSURE.run(http_session, settings))
             listen_task = asyncio.create_task(listen_to_eventsub(http_session, settings))
             console_task = asyncio.create_task(console_input_worker(settings))
+            stop_task = asyncio.create_task(STOP_EVENT.wait())  # exit/restart may also come from the control API
             
-            done, pending = await asyncio.wait([listen_task, console_task], return_when=asyncio.FIRST_COMPLETED)
+            done, pending = await asyncio.wait([listen_task, console_task, stop_task], return_when=asyncio.FIRST_COMPLETED)
             
             for task in pending:
                 task.cancel()
             await asyncio.gather(*pending, return_exceptions=True)
 
-            detector_task.cancel()
-            await asyncio.gather(detector_task, return_exceptions=True)
+            _DETECTOR_TASK.cancel(); watcher_task.cancel(); catalog_task.cancel(); backpressure_task.cancel()
+            await asyncio.gather(_DETECTOR_TASK, watcher_task, catalog_task, backpressure_task, return_exceptions=True)
+            await BACKPRESSURE.release(http_session, settings)
+            if api_runner: await api_runner.cleanup()
+            await BACKPRESSURE.drain(); await REDEMPTIONS.flush(); REDEMPTIONS.bind(None, settings)
             
             try:
                 for task in done:
@@ -445,10 +2721,15 @@ async def main():
                 logger.error("AUTHORIZATION FAILED..."); settings["twitch_oauth_token"] = ""; save_settings(settings); RESTART_FLAG = False
         if not RESTART_FLAG: break
         logger.info("Restarting bot in 3 seconds..."); await asyncio.sleep(3)
+    lag_task.cancel(); WATCHDOG.stop()
+    await PROFILER.stop()
+    SETTINGS_STORE.flush(); REWARD_CATALOG.flush(); HISTORY.close()
     logger.info("Program has terminated.")
 
 if __name__ == "__main__":
     try: asyncio.run(main())
     except KeyboardInterrupt: logger.info("\nScript stopped by user (Ctrl-C).")
     finally:
-        if pygame and pygame.mixer.get_init(): pygame.quit()
\ No newline at end of file
+        SETTINGS_STORE.flush(); REWARD_CATALOG.flush(); HISTORY.close()
+        if pygame and pygame.mixer.get_init(): pygame.quit()
+        shutdown_logging()
\ No newline at end of file